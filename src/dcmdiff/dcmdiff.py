@@ -1,9 +1,14 @@
 """Find differences between DICOM instances, series or studies"""
 
 import argparse
+import concurrent.futures
 import difflib
+import functools
+import html
+import os
 import pathlib
 import re
+import struct
 import sys
 import webbrowser
 
@@ -14,17 +19,51 @@ __version__ = importlib.metadata.version("dcmdiff")
 
 
 # useful patterns for simplifying names
-under = re.compile(r"[\s/^]")
-underb = re.compile(r"^_+")
 underrep = re.compile(r"_{2,}")
-undere = re.compile(r"_+$")
 remove = re.compile(r"[^A-Za-z0-9_-]")
-removep = re.compile(r"[^A-Za-z0-9,.;:=%^&()_+-]")
+
+# table to turn whitespace, slashes and carets into underscores in a single
+# pass (U+3000 is the last character for which str.isspace is true)
+under = str.maketrans(
+    {c: "_" for c in map(chr, range(0x3001)) if c.isspace() or c in "/^"}
+)
+
+# the only tags needed to sort datasets and match instances, the full dataset
+# is only read when an instance is compared
+SORT_TAGS = [
+    "PatientID",
+    "PatientName",
+    "StudyInstanceUID",
+    "StudyDescription",
+    "StudyDate",
+    "StudyTime",
+    "SeriesInstanceUID",
+    "SeriesNumber",
+    "Modality",
+    "SeriesDescription",
+    "SOPInstanceUID",
+    "InstanceNumber",
+]
+SORT_TAGS_LIST = [pydicom.tag.Tag(keyword) for keyword in SORT_TAGS]
+SORT_TAGS_END = max(SORT_TAGS_LIST)
+
+# files in a directory with these names or extensions aren't opened to check
+# whether they are DICOM
+NOT_DICOM_NAMES = frozenset(["DICOMDIR"])
+NOT_DICOM_SUFFIXES = frozenset(
+    [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".txt", ".html", ".xml", ".json", ".pdf"]
+)
+
+
+# message and percentage last printed by progress
+last_progress = None
 
 
 def progress(count, total, message=None):
     """
-    Print percentage progress to stdout during loop.
+    Print percentage progress to stdout during loop. Nothing is printed if
+    neither the message nor the percentage shown have changed since the last
+    call, so long loops don't print a line for every iteration.
 
     :param count: Loop counter
     :type count: int
@@ -36,50 +75,56 @@ def progress(count, total, message=None):
     if message is None:
         message = ""
 
+    global last_progress
+
     percents = round(100.0 * count / float(total), 1)
 
     if total == count:
+        last_progress = None
         print("%s [%3d%%]" % (message, percents))
-    else:
+    elif (message, int(percents)) != last_progress:
+        last_progress = (message, int(percents))
         print("%s [%3d%%]" % (message, percents), end="\r")
 
 
+@functools.lru_cache(maxsize=4096)
 def simplify_under(name):
     """
     Turn spaces and carets into underscores, and tidy up repeated or leading/trailing underscores.
+    Results are cached as the same names turn up in the reference and test.
 
     :param name: string to be cleaned of spaces, carets and repeated underscores
     :type name: str
     :return: s - simplified name
     :rtype: str
     """
-    s = under.subn("_", name)[0]
-    s = underb.subn("", s)[0]
-    s = undere.subn("", s)[0]
-    s = underrep.subn("_", s)[0]
-    s = remove.subn("", s)[0]
+    s = name.translate(under).strip("_")
+    s = underrep.sub("_", s)
+    s = remove.sub("", s)
 
     return s
 
 
+@functools.lru_cache(maxsize=4096)
 def simplify_series(desc):
     """
-    Simplify series description.
+    Simplify series description. Results are cached as the same descriptions
+    turn up in the reference and test.
 
     :param desc: series description
     :type desc: str
     :return: simplified series description
     :rtype: str
     """
-    s = under.subn("_", desc)[0]
-    s = remove.subn("", s)[0]
-    return s
+    return remove.sub("", desc.translate(under))
 
 
 def read_tag_file(tag_fp):
     """
     Read text file containing a list of DICOM tags. Tags can be keywords
-    e.g. RepetitionTime or combined group and element numbers e.g. 0x00180080"
+    e.g. RepetitionTime or combined group and element numbers e.g. 0x00180080".
+    Surrounding whitespace and blank lines are ignored, and repeated tags are
+    only included once.
 
     :param tag_fp: Text file containg a list of DICOM tags
     :type tag_fp: pathlib.Path
@@ -87,20 +132,32 @@ def read_tag_file(tag_fp):
     :rtype: list[pydicom.tag.Tag]
     """
 
-    if tag_fp.is_file():
-        f = open(tag_fp, "r")
-        tc = f.read().splitlines()
-    else:
+    if not tag_fp.is_file():
         sys.stderr.write("ERROR: %s does not exist, exiting\n" % tag_fp)
         sys.exit(1)
 
     tc_list = []
-    for element in tc:
-        try:
-            tag = pydicom.tag.Tag(element)
-            tc_list.append(tag)
-        except Exception as e:
-            sys.stderr.write("WARNING: %s\n" % e)
+    lines_seen = set()
+    tags_seen = set()
+    with open(tag_fp, "r") as f:
+        for line in f:
+            element = line.strip()
+
+            # skip blank lines, and only parse (and warn about) each line once
+            if not element or element in lines_seen:
+                continue
+            lines_seen.add(element)
+
+            try:
+                tag = pydicom.tag.Tag(element)
+            except Exception as e:
+                sys.stderr.write("WARNING: %s\n" % e)
+                continue
+
+            # the same tag can be given as a keyword and as a number
+            if tag not in tags_seen:
+                tags_seen.add(tag)
+                tc_list.append(tag)
 
     if len(tc_list) == 0:
         sys.stderr.write("ERROR: no tags found in %s, exiting\n" % tag_fp)
@@ -109,6 +166,68 @@ def read_tag_file(tag_fp):
         return tc_list
 
 
+def past_sort_tags(tag, vr, length):
+    """
+    Check whether reading a dataset has gone past all the tags in SORT_TAGS,
+    as elements are stored in ascending tag order. Used as a stop_when
+    callback for pydicom.filereader.read_partial.
+
+    :param tag: tag of the next element
+    :type tag: pydicom.tag.BaseTag
+    :param vr: VR of the next element
+    :type vr: str or None
+    :param length: length of the next element
+    :type length: int
+    :return: True if there is nothing more to read
+    :rtype: bool
+    """
+    return tag > SORT_TAGS_END
+
+
+def load_if_dicom(fp):
+    """
+    Load DICOM dataset if a given filepath is a file, DICOM and not a DICOMDIR.
+    Only the tags in SORT_TAGS are read, and reading stops once they have
+    been passed, so the rest of the header and the pixel data are never
+    parsed. The file is only opened once, to check for the DICM prefix and
+    then to read it. Files that can't be opened or parsed are skipped with a
+    warning.
+
+    :param fp: File to check and load
+    :type fp: pathlib.Path
+    :return: DICOM dataset or None if fp isn't a suitable DICOM file
+    :rtype: pydicom.dataset.Dataset
+    """
+
+    if not fp.is_file():
+        return None
+
+    try:
+        with open(fp, "rb") as f:
+            f.seek(128)  # preamble
+            if f.read(4) != b"DICM":
+                return None
+
+            f.seek(0)
+            ds = pydicom.filereader.read_partial(
+                f, stop_when=past_sort_tags, specific_tags=SORT_TAGS_LIST
+            )
+    except (
+        OSError,
+        pydicom.errors.InvalidDicomError,
+        ValueError,
+        struct.error,
+    ) as e:
+        sys.stderr.write("WARNING: unable to read %s: %s\n" % (fp, e))
+        return None
+
+    sop_class = ds.file_meta.get("MediaStorageSOPClassUID", None)
+    if sop_class != pydicom.uid.MediaStorageDirectoryStorage:
+        return ds
+
+    return None
+
+
 def append_if_dicom(fp, ds_list):
     """
     Load DICOM dataset and append to a list if a given filepath is a file, DICOM
@@ -122,22 +241,76 @@ def append_if_dicom(fp, ds_list):
     :rtype: list[pydicom.dataset.Dataset]
     """
 
-    if fp.is_file() and pydicom.misc.is_dicom(fp):
-        ds = pydicom.dcmread(fp, stop_before_pixels=True)
-
-        sop_class = ds.file_meta.get("MediaStorageSOPClassUID", None)
-        if sop_class != pydicom.uid.MediaStorageDirectoryStorage:
-            ds_list.append(ds)
+    ds = load_if_dicom(fp)
+    if ds is not None:
+        ds_list.append(ds)
 
     return ds_list
 
 
-def make_ds_list(pth):
+def list_files(pth):
     """
-    Create a list of DICOM datasets
+    List the files in a directory and its sub-directories, skipping hidden
+    files and directories, and files that are obviously not DICOM (see
+    NOT_DICOM_NAMES and NOT_DICOM_SUFFIXES). Files are sorted by path, in the
+    same order as sorted(pth.rglob("*")), so series and instances are always
+    listed in the same order.
+
+    :param pth: Directory
+    :type pth: pathlib.Path
+    :return: List of files
+    :rtype: list[pathlib.Path]
+    """
+
+    fp_list = []
+    for root, dirs, files in os.walk(pth):
+        # prune hidden directories so os.walk doesn't descend into them
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        root_pth = pathlib.Path(root)
+        for name in files:
+            if (
+                name.startswith(".")
+                or name in NOT_DICOM_NAMES
+                or os.path.splitext(name)[1].lower() in NOT_DICOM_SUFFIXES
+            ):
+                continue
+            fp_list.append(root_pth / name)
+
+    # os.walk lists a directory's files before its sub-directories, so sort
+    # the whole list to keep the order of files across directories
+    return sorted(fp_list)
+
+
+def make_executor(threads=False):
+    """
+    Create a pool of worker processes, or a pool of threads which can be
+    quicker when the work is mostly waiting on slow reads e.g. from a
+    network share. Workers are only started once work is given to the pool.
+
+    :param threads: use threads rather than processes
+    :type threads: bool
+    :return: pool of workers
+    :rtype: concurrent.futures.Executor
+    """
+
+    if threads:
+        return concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(32, (os.cpu_count() or 1) * 4)
+        )
+    else:
+        return concurrent.futures.ProcessPoolExecutor()
+
+
+def make_ds_list(pth, threads=False):
+    """
+    Create a list of DICOM datasets. Files in a directory are loaded in
+    parallel using a pool of worker processes, or a pool of threads which can
+    be quicker when reading the files is slow, e.g. on a network share.
 
     :param pth: File or directory
     :type pth: pathlib.Path
+    :param threads: load files using threads rather than processes
+    :type threads: bool
     :return: List of DICOM datasets
     :rtype: list[pydicom.dataset.Dataset]
     """
@@ -147,14 +320,17 @@ def make_ds_list(pth):
         ds_list = append_if_dicom(pth, ds_list)
 
     elif pth.is_dir():
-        pth_list_all = sorted(pth.rglob("*"))
-        for pth_counter, pth_temp in enumerate(pth_list_all, 1):
-            progress(
-                pth_counter,
-                len(pth_list_all),
-                "** loading %d files" % (len(pth_list_all)),
-            )
-            ds_list = append_if_dicom(pth_temp, ds_list)
+        pth_list_all = list_files(pth)
+        with make_executor(threads) as executor:
+            ds_iter = executor.map(load_if_dicom, pth_list_all, chunksize=32)
+            for pth_counter, ds in enumerate(ds_iter, 1):
+                progress(
+                    pth_counter,
+                    len(pth_list_all),
+                    "** loading %d files" % (len(pth_list_all)),
+                )
+                if ds is not None:
+                    ds_list.append(ds)
 
     else:
         sys.stderr.write("ERROR: %s is neither a file or directory\n" % pth)
@@ -173,17 +349,24 @@ def sort_ds_list(ds_list):
     levels/heirachy
 
     1.PATIENT with PatientID as the key
-    2.STUDY with StudyInstanceUID as the key
-    3.SERIES with SeriesInstanceUID as the key
-    4.INSTANCE with SOPInstanceUID as the key
+    2.STUDY with StudyInstanceUID as the key (under "studies")
+    3.SERIES with SeriesInstanceUID as the key (under "series")
+    4.INSTANCE with SOPInstanceUID as the key (under "instances")
+
+    The details of each patient, study and series are kept alongside the
+    dictionary of the next level down, so the UIDs at each level can be
+    iterated over directly. Only the filepath and InstanceNumber of each
+    instance are kept, the dataset is read again from the file when it is
+    compared.
 
     :param ds_list: List of DICOM datasets
     :type ds_list: list[pydicom.dataset.Dataset]
-    :return: Nested dictionary of DICOM datasets
+    :return: Nested dictionary of instance details (filepath, InstanceNumber)
     :rtype: dict
 
     """
     ds_dict = {}
+    sop_uids_seen = set()
     for ds_counter, ds in enumerate(ds_list, 1):
         progress(
             ds_counter,
@@ -191,57 +374,74 @@ def sort_ds_list(ds_list):
             "** sorting %d datasets" % (len(ds_list)),
         )
 
-        if ds.PatientID not in ds_dict:
+        # SOPInstanceUIDs are unique, so only the first copy of an instance is
+        # kept and repeats are skipped before any other work is done
+        sop_uid = ds.SOPInstanceUID
+        if sop_uid in sop_uids_seen:
+            continue
+        sop_uids_seen.add(sop_uid)
+
+        # look up each UID once, and each level of the dictionary once
+        patient_id = ds.PatientID
+        study_uid = ds.StudyInstanceUID
+        series_uid = ds.SeriesInstanceUID
+
+        patient_dict = ds_dict.get(patient_id)
+        if patient_dict is None:
             pt_name = str(ds.get("PatientName", "unknown"))
             clean_pt_name = simplify_under(pt_name.lower())
-            ds_dict[ds.PatientID] = {"patient_name": clean_pt_name}
+            patient_dict = ds_dict[patient_id] = {
+                "patient_name": clean_pt_name,
+                "studies": {},
+            }
 
-        if ds.StudyInstanceUID not in ds_dict[ds.PatientID]:
+        study_dict = patient_dict["studies"].get(study_uid)
+        if study_dict is None:
             study_desc = str(ds.get("StudyDescription", "unknown"))
             study_date = str(ds.get("StudyDate", 20000101))
             study_time = str(ds.get("StudyTime", 120000.00)).split(".")[0]
             study_dts = study_date + "." + study_time
             clean_study_desc = simplify_series(study_desc)
 
-            ds_dict[ds.PatientID][ds.StudyInstanceUID] = {
+            study_dict = patient_dict["studies"][study_uid] = {
                 "study_datetime": study_dts,
                 "study_desc": clean_study_desc,
+                "series": {},
             }
 
-        if ds.SeriesInstanceUID not in ds_dict[ds.PatientID][ds.StudyInstanceUID]:
+        series_dict = study_dict["series"].get(series_uid)
+        if series_dict is None:
             series_num = int(ds.get("SeriesNumber", 1))
             modality = str(ds.get("Modality", "unknown"))
             series_desc = str(ds.get("SeriesDescription", "unknown"))
             clean_series_desc = simplify_series(series_desc)
-            ds_dict[ds.PatientID][ds.StudyInstanceUID][ds.SeriesInstanceUID] = {
+            series_dict = study_dict["series"][series_uid] = {
                 "series_num": series_num,
                 "modality": modality,
                 "series_desc": clean_series_desc,
+                "instances": {},
             }
 
-        if (
-            ds.SOPInstanceUID
-            not in ds_dict[ds.PatientID][ds.StudyInstanceUID][ds.SeriesInstanceUID]
-        ):
-            ds_dict[ds.PatientID][ds.StudyInstanceUID][ds.SeriesInstanceUID][
-                ds.SOPInstanceUID
-            ] = ds
+        series_dict["instances"][sop_uid] = (
+            ds.filename,
+            int(ds.get("InstanceNumber", 1)),
+        )
 
     return ds_dict
 
 
 def get_patient_ds_dict(ds_dict):
     """
-    Get the nested dictionary of DICOM datasets belonging to a single patient
+    Get the nested dictionary of DICOM instances belonging to a single patient
     i.e. with the following levels
 
-    1.STUDY with StudyInstanceUID as the key
-    2.SERIES with SeriesInstanceUID as the key
-    3.INSTANCE with SOPInstanceUID as the key
+    1.STUDY with StudyInstanceUID as the key (under "studies")
+    2.SERIES with SeriesInstanceUID as the key (under "series")
+    3.INSTANCE with SOPInstanceUID as the key (under "instances")
 
-    :param ds_dict: nested dictionary of DICOM datasets
+    :param ds_dict: nested dictionary of DICOM instances
     :type ds_dict: dict
-    :return: Nested dictionary of DICOM datasets belonging to a patient
+    :return: Nested dictionary of DICOM instances belonging to a patient
     :rtype: dict
     """
 
@@ -251,11 +451,14 @@ def get_patient_ds_dict(ds_dict):
         result = ds_dict[patient_id]
     else:
         print("** found %d patients:" % len(patient_ids))
-        for counter, patient_id in enumerate(patient_ids):
-            print(
+        # print the whole table in one go
+        print(
+            "\n".join(
                 "%4d - %s-%s"
                 % (counter, patient_id, ds_dict[patient_id]["patient_name"])
+                for counter, patient_id in enumerate(patient_ids)
             )
+        )
 
         print("** select ONE patient:")
         pt_choice = int(input("? "))
@@ -266,56 +469,58 @@ def get_patient_ds_dict(ds_dict):
 
 def get_study_ds_dict(ds_dict):
     """
-    Get the nested dictionary of DICOM datasets belonging to a single study
+    Get the nested dictionary of DICOM instances belonging to a single study
     i.e. with the following levels
 
-    1.SERIES with SeriesInstanceUID as the key
-    2.INSTANCE with SOPInstanceUID as the key
+    1.SERIES with SeriesInstanceUID as the key (under "series")
+    2.INSTANCE with SOPInstanceUID as the key (under "instances")
 
-    :param ds_dict: nested dictionary of DICOM datasets
+    :param ds_dict: nested dictionary of DICOM instances
     :type ds_dict: dict
-    :return: Nested dictionary of DICOM datasets belonging to a patient
+    :return: Nested dictionary of DICOM instances belonging to a patient
     :rtype: dict
     """
 
-    study_uids = list(ds_dict.keys())
-    # Remove the patient_name key from the list so that the only keys at the study
-    # level are StudyInstanceUIDs
-    study_uids.remove("patient_name")
+    studies = ds_dict["studies"]
+    study_uids = list(studies.keys())
     if len(study_uids) == 1:
         study_uid = study_uids[0]
-        result = ds_dict[study_uid]
+        result = studies[study_uid]
     else:
         print("*** found %d studies:" % len(study_uids))
-        for counter, study_uid in enumerate(study_uids):
-            print(
+        print(
+            "\n".join(
                 "%4d - %s-%s"
                 % (
                     counter,
-                    ds_dict[study_uid]["study_datetime"],
-                    ds_dict[study_uid]["study_desc"],
+                    studies[study_uid]["study_datetime"],
+                    studies[study_uid]["study_desc"],
                 )
+                for counter, study_uid in enumerate(study_uids)
             )
+        )
 
         print("*** select one study:")
         study_choice = int(input("? "))
-        result = ds_dict[study_uids[study_choice]]
+        result = studies[study_uids[study_choice]]
 
     return result
 
 
-def get_all_series_details(pth):
+def get_all_series_details(pth, threads=False):
     """
     Get the series information from a DICOM file or directory of DICOM files
 
     :param pth: File or directory
     :type pth: pathlib.Path
+    :param threads: load files using threads rather than processes
+    :type threads: bool
     :return: Series details (SeriesInstanceUID, SeriesNumber, Modality, SeriesDescription, Dictionary of Instances)
     :rtype: list [(str,int,str,str,dict)]
     """
 
     # Create a list of input files
-    ds_list = make_ds_list(pth)
+    ds_list = make_ds_list(pth, threads)
 
     # Sort all the DICOM files into a hierarchical dictionary
     ds_dict = sort_ds_list(ds_list)
@@ -326,18 +531,12 @@ def get_all_series_details(pth):
     # Get the user to select one study (if there are multiple)
     ds_study_dict = get_study_ds_dict(ds_pat_dict)
 
-    series_uids = list(ds_study_dict.keys())
-    # Remove the study_datetime and study_desc keys from the list so that the
-    # only keys are SeriesInstanceUIDs
-    series_uids.remove("study_datetime")
-    series_uids.remove("study_desc")
     series_details = []
-    for series_uid in series_uids:
-        series_num = ds_study_dict[series_uid]["series_num"]
-        modality = ds_study_dict[series_uid]["modality"]
-        series_desc = ds_study_dict[series_uid]["series_desc"]
+    for series_uid, result in ds_study_dict["series"].items():
+        series_num = result["series_num"]
+        modality = result["modality"]
+        series_desc = result["series_desc"]
 
-        result = ds_study_dict[series_uid]
         series_details.append((series_uid, series_num, modality, series_desc, result))
 
     return series_details
@@ -353,8 +552,9 @@ def choose_series(all_ser_list):
     :rtype: (str,int,str,str,dict)
     """
 
-    for counter, ser in enumerate(all_ser_list):
-        print(
+    # print the whole table in one go
+    print(
+        "\n".join(
             "%4d - %04d-%s-%s"
             % (
                 counter,
@@ -362,7 +562,9 @@ def choose_series(all_ser_list):
                 ser[2],
                 ser[3],
             )
+            for counter, ser in enumerate(all_ser_list)
         )
+    )
 
     print("select one series (n=none):")
     ser_choice = input("? ")
@@ -373,7 +575,25 @@ def choose_series(all_ser_list):
         return all_ser_list[ser_choice][4]
 
 
-def find_matching_series(ref_modality, ref_ser_desc, test_ser_all):
+def make_series_dict(all_ser_list):
+    """
+    Group series by Modality and SeriesDescription, so that matching series
+    can be looked up directly
+
+    :param all_ser_list: list of series details (SeriesInstanceUID, SeriesNumber, Modality, SeriesDescription, Dictionary of Instances)
+    :type all_ser_list: list[(str,int,str,str,dict)]
+    :return: lists of series details with (Modality, SeriesDescription) as
+        the key
+    :rtype: dict[(str,str), list[(str,int,str,str,dict)]]
+    """
+    ser_dict = {}
+    for ser in all_ser_list:
+        ser_dict.setdefault((ser[2], ser[3]), []).append(ser)
+
+    return ser_dict
+
+
+def find_matching_series(ref_modality, ref_ser_desc, test_ser_all, test_ser_dict=None):
     """
     Find matching series based on Modality and SeriesDescription
 
@@ -383,15 +603,17 @@ def find_matching_series(ref_modality, ref_ser_desc, test_ser_all):
     :type ref_ser_desc: str
     :param test_ser_all: list of series details (SeriesInstanceUID, SeriesNumber, Modality, SeriesDescription, Dictionary of Instances)
     :type test_ser_all: list[(str,int,str,str,dict)]
+    :param test_ser_dict: test_ser_all grouped by make_series_dict, built
+        here if not given
+    :type test_ser_dict: dict[(str,str), list[(str,int,str,str,dict)]]
     :return: dictionary of DICOM instances in chosen series
     :rtype: dict
     """
 
-    match_ser = []
+    if test_ser_dict is None:
+        test_ser_dict = make_series_dict(test_ser_all)
 
-    for t_ser in test_ser_all:
-        if ref_modality == t_ser[2] and ref_ser_desc == t_ser[3]:
-            match_ser.append(t_ser)
+    match_ser = test_ser_dict.get((ref_modality, ref_ser_desc), [])
 
     if len(match_ser) == 0:
         print(
@@ -415,21 +637,23 @@ def choose_instance(all_inst_list):
     """
     Chose one instance from a list
 
-    :param all_inst_list: list of DICOM datasets (instances)
-    :type all_inst_list: list[pydicom.dataset.Dataset]
-    :return: DICOM dataset
-    :rtype: pydicom.dataset.Dataset
+    :param all_inst_list: list of instance details (filepath, InstanceNumber)
+    :type all_inst_list: list[(str,int)]
+    :return: instance details (filepath, InstanceNumber)
+    :rtype: (str,int)
     """
 
-    for counter, ds in enumerate(all_inst_list):
-        inst_num = int(ds.get("InstanceNumber", 1))
-        print(
+    # print the whole table in one go
+    print(
+        "\n".join(
             "%4d - instance number %04d"
             % (
                 counter,
-                inst_num,
+                inst[1],
             )
+            for counter, inst in enumerate(all_inst_list)
         )
+    )
 
     print("select one instance (n=none):")
     ser_choice = input("? ")
@@ -440,67 +664,164 @@ def choose_instance(all_inst_list):
         return all_inst_list[ser_choice]
 
 
-def find_matching_instance(r_inst_num, test_uid_dict):
+def make_inst_num_dict(series_ds_dict):
+    """
+    Group the instances in a series by InstanceNumber, so that matching
+    instances can be looked up directly
+
+    :param series_ds_dict: dictionary of instances in a series
+    :type series_ds_dict: dict
+    :return: lists of instance details (filepath, InstanceNumber) with
+        InstanceNumber as the key
+    :rtype: dict[int, list[(str,int)]]
+    """
+    inst_num_dict = {}
+    for inst in series_ds_dict["instances"].values():
+        inst_num_dict.setdefault(inst[1], []).append(inst)
+
+    return inst_num_dict
+
+
+def find_matching_instance(r_inst_num, inst_num_dict):
     """
     Find matching instances based on InstanceNumber
 
     :param r_inst_num: Instance Number
     :type r_inst_num: int
-    :param test_uid_dict: dictionary of instances to find match in
-    :type test_uid_dict: dict
-    :return: DICOM dataset
-    :rtype: pydicom.dataset.Dataset
+    :param inst_num_dict: instances to find match in, from make_inst_num_dict
+    :type inst_num_dict: dict[int, list[(str,int)]]
+    :return: instance details (filepath, InstanceNumber)
+    :rtype: (str,int)
     """
 
-    match_inst = []
-    all_inst = []
-    t_uids = list(test_uid_dict.keys())
-    t_uids.remove("series_num")
-    t_uids.remove("modality")
-    t_uids.remove("series_desc")
-    for t_uid in t_uids:
-        all_inst.append(test_uid_dict[t_uid])
-        t_inst_num = test_uid_dict[t_uid].get("InstanceNumber", 1)
-        if t_inst_num == r_inst_num:
-            match_inst.append(test_uid_dict[t_uid])
+    match_inst = inst_num_dict.get(r_inst_num, [])
 
     if len(match_inst) == 0:
-        if len(t_uids) == 1:
-            t_ds = test_uid_dict[t_uids[0]]
-        else:
-            t_ds = None
+        # if the test series only has one instance, compare with that
+        t_inst = None
+        if len(inst_num_dict) == 1:
+            all_inst = next(iter(inst_num_dict.values()))
+            if len(all_inst) == 1:
+                t_inst = all_inst[0]
     elif len(match_inst) == 1:
-        t_ds = match_inst[0]
+        t_inst = match_inst[0]
     else:
         print(
             "\n*** %d Instances with matching Instance Number found:" % len(match_inst)
         )
-        t_ds = choose_instance(match_inst)
+        t_inst = choose_instance(match_inst)
 
-    return t_ds
+    return t_inst
 
 
-def keep_tags(ds, tags_to_keep):
+def filter_ds(
+    ds,
+    tags_to_keep=None,
+    tags_to_rm=None,
+    vrs_to_remove=None,
+    groups_to_remove=None,
+    remove_private=False,
+):
     """
-    Keep selected tags in DICOM dataset
+    Remove tags from DICOM dataset using a single walk through the dataset.
+    A tag is removed if it matches any of the given filters. The filters are
+    converted to frozensets so each check is a constant time lookup.
 
     :param ds: DICOM dataset
     :type ds: pydicom.dataset.Dataset
-    :param tags_to_keep: list of tags to keep
-    :type tags_to_keep: list[pydicom.tag.BaseTag]
+    :param tags_to_keep: tags to keep, or None to keep all tags
+    :type tags_to_keep: list[pydicom.tag.BaseTag] or frozenset[pydicom.tag.BaseTag]
+    :param tags_to_rm: tags to remove
+    :type tags_to_rm: list[pydicom.tag.BaseTag] or frozenset[pydicom.tag.BaseTag]
+    :param vrs_to_remove: value representations (VR) of tags to remove
+    :type vrs_to_remove: list[str] or frozenset[str]
+    :param groups_to_remove: group numbers to remove e.g. 0x10
+    :type groups_to_remove: list[int] or frozenset[int]
+    :param remove_private: remove all tags with an odd group number
+    :type remove_private: bool
     :return: DICOM dataset with tags removed
     :rtype: pydicom.dataset.Dataset
     """
 
+    if (
+        tags_to_keep is None
+        and not tags_to_rm
+        and not vrs_to_remove
+        and not groups_to_remove
+        and not remove_private
+    ):
+        return ds
+
+    if tags_to_keep is not None:
+        tags_to_keep = frozenset(tags_to_keep)
+    tags_to_rm = frozenset(tags_to_rm or ())
+    vrs_to_remove = frozenset(vrs_to_remove or ())
+    groups_to_remove = frozenset(groups_to_remove or ())
+
     def callback(ds_a, elem):
-        if elem.tag not in tags_to_keep:
-            del ds_a[elem.tag]
+        # the group is worked out with plain int operations, as the Tag.group
+        # and Tag.is_private properties are much slower for every element
+        tag = elem.tag
+        group = tag >> 16
+        if (
+            (tags_to_keep is not None and tag not in tags_to_keep)
+            or (tags_to_rm and tag in tags_to_rm)
+            or (vrs_to_remove and elem.VR in vrs_to_remove)
+            or (groups_to_remove and group in groups_to_remove)
+            or (remove_private and group & 1)
+        ):
+            del ds_a[tag]
 
     ds.walk(callback)
 
     return ds
 
 
+def make_file_meta_filters(filters):
+    """
+    Reduce keyword arguments for filter_ds to those that can match file meta
+    information, which only holds group 0x0002 elements and no private ones.
+    If nothing is left, filter_ds returns the file meta information unchanged
+    without walking it.
+
+    :param filters: keyword arguments for filter_ds
+    :type filters: dict
+    :return: keyword arguments for filter_ds to apply to file meta information
+    :rtype: dict
+    """
+    tags_to_rm = frozenset(
+        tag
+        for tag in filters.get("tags_to_rm") or ()
+        if pydicom.tag.Tag(tag).group == 0x0002
+    )
+    groups_to_remove = frozenset(
+        group for group in filters.get("groups_to_remove") or () if group == 0x0002
+    )
+
+    return {
+        "tags_to_keep": filters.get("tags_to_keep"),
+        "tags_to_rm": tags_to_rm or None,
+        "vrs_to_remove": filters.get("vrs_to_remove"),
+        "groups_to_remove": groups_to_remove or None,
+        "remove_private": False,
+    }
+
+
+def keep_tags(ds, tags_to_keep):
+    """
+    Keep selected tags in DICOM dataset
+
+    :param ds: DICOM dataset
+    :type ds: pydicom.dataset.Dataset
+    :param tags_to_keep: list of tags to keep
+    :type tags_to_keep: list[pydicom.tag.BaseTag]
+    :return: DICOM dataset with tags removed
+    :rtype: pydicom.dataset.Dataset
+    """
+
+    return filter_ds(ds, tags_to_keep=tags_to_keep)
+
+
 def remove_tags(ds, tags_to_rm):
     """
     Remove selected tags from DICOM dataset
@@ -513,13 +834,7 @@ def remove_tags(ds, tags_to_rm):
     :rtype: pydicom.dataset.Dataset
     """
 
-    def callback(ds_a, elem):
-        if elem.tag in tags_to_rm:
-            del ds_a[elem.tag]
-
-    ds.walk(callback)
-
-    return ds
+    return filter_ds(ds, tags_to_rm=tags_to_rm)
 
 
 def remove_vr_tags(ds, vrs_to_remove):
@@ -534,12 +849,7 @@ def remove_vr_tags(ds, vrs_to_remove):
     :rtype: pydicom.dataset.Dataset
     """
 
-    def callback(ds_a, elem):
-        if elem.VR in vrs_to_remove:
-            del ds_a[elem.tag]
-
-    ds.walk(callback)
-    return ds
+    return filter_ds(ds, vrs_to_remove=vrs_to_remove)
 
 
 def remove_group_tags(ds, groups_to_remove):
@@ -548,33 +858,250 @@ def remove_group_tags(ds, groups_to_remove):
 
     :param ds: DICOM dataset
     :type ds: pydicom.dataset.Dataset
-    :param groups_to_remove: group to remove as hex str e.g. 0x10
-    :type groups_to_remove: list[str]
+    :param groups_to_remove: group numbers to remove e.g. 0x10
+    :type groups_to_remove: list[int]
     :return: DICOM dataset with tags removed
     :rtype: pydicom.dataset.Dataset
     """
-    group_rm = []
-    for group in groups_to_remove:
-        group_rm.append(int(group, 16))
 
-    def callback(ds_a, elem):
-        if elem.tag.group in group_rm:
-            del ds_a[elem.tag]
+    return filter_ds(ds, groups_to_remove=groups_to_remove)
 
-    ds.walk(callback)
-    return ds
+
+# names of public data elements by tag, the same few hundred tags turn up in
+# every instance (the names of private elements also depend on their private
+# creator, so aren't cached)
+elem_names = {}
+
+
+def elem_to_str(elem, indent_str=""):
+    """
+    Format a (non-sequence) data element exactly as indent_str + str(elem),
+    but in a single f-string rather than a call to DataElement.__str__ and
+    a concatenation. The names of public elements are looked up in the
+    dictionary once and then cached in elem_names. This copies the layout of
+    pydicom's DataElement.__str__, which is not a stable API, so the output
+    must be kept identical to str(elem) if pydicom changes it.
+
+    :param elem: DICOM data element
+    :type elem: pydicom.dataelem.DataElement
+    :param indent_str: indentation to put in front of the element
+    :type indent_str: str
+    :return: formatted element
+    :rtype: str
+    """
+    tag = elem.tag
+    name = elem_names.get(tag)
+    if name is None:
+        name = elem.name
+        if not (tag >> 16) & 1:
+            elem_names[tag] = name
+
+    width = elem.descripWidth
+    name = name[:width]
+    value = elem.repval or ""
+    if elem.showVR:
+        return f"{indent_str}{tag} {name:<{width}} {elem.VR}: {value}"
+
+    return f"{indent_str}{tag} {name:<{width}} {value}"
+
+
+def iter_ds_strings(ds, indent=0):
+    """
+    Generate the strings that make up str(ds) one at a time, in the same
+    order and with the same indentation as pydicom, without building the
+    string for the whole dataset. This follows pydicom's private
+    Dataset._pretty_str, so the output must be kept identical to str(ds)
+    (test_tags_to_list_matches_str checks this)
+
+    :param ds: DICOM dataset
+    :type ds: pydicom.dataset.Dataset
+    :param indent: indentation level
+    :type indent: int
+    :return: strings that str(ds) joins with newlines
+    :rtype: collections.abc.Iterator[str]
+    """
+    indent_str = ds.indent_chars * indent
+    nextindent_str = ds.indent_chars * (indent + 1)
+
+    if getattr(ds, "file_meta", None) and pydicom.config.show_file_meta:
+        yield f"{'Dataset.file_meta ':-<49}"
+        for elem in ds.file_meta:
+            yield elem_to_str(elem, indent_str)
+        yield f"{'':-<49}"
+
+    for elem in ds:
+        if elem.VR == "SQ":
+            yield (
+                f"{indent_str}{elem.tag}  {elem.name}  {len(elem.value)} item(s) ---- "
+            )
+            for item in elem.value:
+                empty = True
+                for string in iter_ds_strings(item, indent + 1):
+                    empty = False
+                    yield string
+                if empty:
+                    yield ""
+                yield nextindent_str + "---------"
+        else:
+            yield elem_to_str(elem, indent_str)
 
 
 def tags_to_list(ds):
     """
     Convert DICOM dataset to a list of strings each terminated by a newline
+    (apart from the last one), exactly as str(ds).splitlines(keepends=True)
 
     :param ds: DICOM dataset
     :type ds: pydicom.dataset.Dataset
     :return: list of strings
     :rtype: list[str]
     """
-    return str(ds).splitlines(keepends=True)
+    lines = []
+    strings = iter_ds_strings(ds)
+    prev = next(strings, None)
+    for string in strings:
+        # multi-valued elements can contain their own line breaks
+        lines.extend((prev + "\n").splitlines(keepends=True))
+        prev = string
+
+    if prev is not None:
+        lines.extend(prev.splitlines(keepends=True))
+
+    return lines
+
+
+def make_html_diff(a, b, fromdesc, todesc, context, numlines, unified=False):
+    """
+    Make an HTML file showing the differences between two lists of strings.
+    By default this is a side-by-side table from difflib.HtmlDiff, which can
+    be slow for large, dissimilar datasets. Alternatively a unified diff,
+    coloured with CSS, can be produced instead.
+
+    :param a: list of strings from the reference
+    :type a: list[str]
+    :param b: list of strings from the test
+    :type b: list[str]
+    :param fromdesc: description of the reference
+    :type fromdesc: str
+    :param todesc: description of the test
+    :type todesc: str
+    :param context: only show differences with numlines of context
+    :type context: bool
+    :param numlines: number of context lines
+    :type numlines: int
+    :param unified: produce a unified diff rather than a side-by-side table
+    :type unified: bool
+    :return: HTML file contents
+    :rtype: str
+    """
+
+    if not unified:
+        return difflib.HtmlDiff().make_file(
+            a, b, fromdesc=fromdesc, todesc=todesc, context=context, numlines=numlines
+        )
+
+    if not context:
+        numlines = max(len(a), len(b))
+
+    html_lines = []
+    # the diff is read as it is generated, and identical instances (common
+    # when comparing a series with a copy of itself) skip difflib altogether
+    if a != b:
+        for i, line in enumerate(
+            difflib.unified_diff(
+                a, b, fromfile=fromdesc, tofile=todesc, n=numlines, lineterm=""
+            )
+        ):
+            line = html.escape(line.rstrip("\n"))
+            # only the first two lines are file headers, later lines starting
+            # with "---" are removed separators from the dataset strings
+            if i < 2:
+                html_lines.append('<span class="file">%s</span>' % line)
+            elif line.startswith("@@"):
+                html_lines.append('<span class="hunk">%s</span>' % line)
+            elif line.startswith("+"):
+                html_lines.append('<span class="add">%s</span>' % line)
+            elif line.startswith("-"):
+                html_lines.append('<span class="sub">%s</span>' % line)
+            else:
+                html_lines.append(line)
+
+    if len(html_lines) == 0:
+        html_lines.append("No Differences Found")
+
+    return "".join(
+        [
+            "<!DOCTYPE html>\n",
+            "<html>\n",
+            "<head>\n",
+            '<meta charset="utf-8">\n',
+            "<style>\n",
+            ".file {font-weight: bold}\n",
+            ".hunk {color: blue}\n",
+            ".add {background-color: #aaffaa}\n",
+            ".sub {background-color: #ffaaaa}\n",
+            "</style>\n",
+            "</head>\n",
+            "<body>\n",
+            "<pre>\n",
+            "\n".join(html_lines),
+            "\n</pre>\n",
+            "</body>\n",
+            "</html>",
+        ]
+    )
+
+
+def compare_instance(task):
+    """
+    Compare a reference instance with a test instance and write the
+    differences to an HTML file. This runs in a worker process, so it takes
+    a single picklable tuple.
+
+    :param task: SOPInstanceUID of the reference instance, reference
+        filepath, test filepath (None if there is no matching test instance),
+        output directory, keyword arguments for filter_ds for the dataset and
+        for its file meta information, and keyword arguments for
+        make_html_diff
+    :type task: (str, str, str or None, pathlib.Path, dict, dict, dict)
+    :return: filepath of the HTML file
+    :rtype: pathlib.Path
+    """
+    r_uid, r_fp, t_fp, out_dir, filters, meta_filters, diff_opts = task
+
+    fp_instance_html = out_dir / (r_uid + ".html")
+
+    if t_fp is not None:
+        rep = []
+        for ds_fp in [r_fp, t_fp]:
+            ds = pydicom.dcmread(ds_fp, stop_before_pixels=True)
+
+            # each instance is filtered on its own, as instances in a series
+            # don't always have the same elements
+            ds = filter_ds(ds, **filters)
+            ds.file_meta = filter_ds(ds.file_meta, **meta_filters)
+
+            rep.append(tags_to_list(ds))
+
+        diff = make_html_diff(
+            rep[0], rep[1], fromdesc="Reference", todesc="Test", **diff_opts
+        )
+
+        with open(fp_instance_html, "w", encoding="utf-8") as f:
+            f.write(diff)
+    else:
+        with open(fp_instance_html, "w", encoding="utf-8") as f:
+            f.write(
+                "<!DOCTYPE html>\n"
+                "<html>\n"
+                "<body>\n"
+                "<h1>Instance %s</h1>\n"
+                "<p>No instance from test series found or selected for comparison</p>\n"
+                "</body>\n"
+                "</html>" % r_uid
+            )
+
+    return fp_instance_html
 
 
 def main():
@@ -629,6 +1156,13 @@ def main():
         help="number of context lines (default: %(default)s)",
     )
 
+    parser.add_argument(
+        "--unified",
+        action="store_true",
+        help="produce a unified format diff rather than a side-by-side table, "
+        "this is faster for large datasets with many differences",
+    )
+
     parser.add_argument(
         "--compare-one-inst",
         dest="compare_one_inst",
@@ -636,6 +1170,13 @@ def main():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="load and compare DICOM files using threads rather than processes, "
+        "which can be faster when the files are on a network share",
+    )
+
     parser.add_argument(
         "--ignore-private",
         dest="ignore_private",
@@ -691,174 +1232,155 @@ def main():
 
     if args.c:
         print("* loading", args.c)
-        tags_to_compare = read_tag_file(args.c)
+        tags_to_compare = frozenset(read_tag_file(args.c))
     else:
         tags_to_compare = None
 
+    if args.ignore_group is not None:
+        groups_to_ignore = frozenset(int(group, 16) for group in args.ignore_group)
+    else:
+        groups_to_ignore = None
+
+    if args.ignore_vr is not None:
+        vrs_to_ignore = frozenset(args.ignore_vr)
+    else:
+        vrs_to_ignore = None
+
+    if args.ignore_tag:
+        tags_to_ignore = frozenset(pydicom.tag.Tag(tag) for tag in args.ignore_tag)
+    else:
+        tags_to_ignore = None
+
     print("* processing reference DICOM(s)")
-    r_series_details = get_all_series_details(args.r)
+    r_series_details = get_all_series_details(args.r, args.threads)
 
     print("* processing test DICOM(s)")
-    t_series_details = get_all_series_details(args.t)
+    t_series_details = get_all_series_details(args.t, args.threads)
 
     fp_study_html = out_dir / "study_index.html"
 
-    f_study_html = open(fp_study_html, "w")
-    f_study_html.writelines(
-        [
-            "<!DOCTYPE html>\n",
-            "<html>\n",
-            "<body>\n",
-            "<h1>DICOM Study</h1>\n",
-            "<p>Select a reference series to view differences:</p>\n",
-            '<ol type= "1">\n',
-        ]
-    )
+    # html pages are built up as lists of strings and written in one go
+    study_html = [
+        "<!DOCTYPE html>\n",
+        "<html>\n",
+        "<body>\n",
+        "<h1>DICOM Study</h1>\n",
+        "<p>Select a reference series to view differences:</p>\n",
+        '<ol type= "1">\n',
+    ]
+
+    filters = {
+        "tags_to_keep": tags_to_compare,
+        "tags_to_rm": tags_to_ignore,
+        "vrs_to_remove": vrs_to_ignore,
+        "groups_to_remove": groups_to_ignore,
+        "remove_private": args.ignore_private,
+    }
+    meta_filters = make_file_meta_filters(filters)
+    diff_opts = {
+        "context": args.context,
+        "numlines": args.lines,
+        "unified": args.unified,
+    }
+
+    t_series_dict = make_series_dict(t_series_details)
 
     print("* comparing DICOM instance(s) in series:")
-    for r_series in r_series_details:
-        ref_series_str = "%04d-%s-%s" % (
-            r_series[1],
-            r_series[2],
-            r_series[3],
-        )
+    with make_executor(args.threads) as executor:
+        for r_series in r_series_details:
+            ref_series_str = "%04d-%s-%s" % (
+                r_series[1],
+                r_series[2],
+                r_series[3],
+            )
 
-        print("** %s:" % ref_series_str)
-        fp_series_html = out_dir / (ref_series_str + ".html")
-        f_series_html = open(fp_series_html, "w")
+            print("** %s:" % ref_series_str)
+            fp_series_html = out_dir / (ref_series_str + ".html")
+            series_html = []
 
-        f_study_html.writelines(
-            ['<li><a href="%s">%s</a></li>\n' % (str(fp_series_html), ref_series_str)]
-        )
+            study_html.append(
+                '<li><a href="%s">%s</a></li>\n' % (str(fp_series_html), ref_series_str)
+            )
 
-        r_series_ds_dict = r_series[4]
+            r_series_ds_dict = r_series[4]
 
-        t_series_ds_dict = find_matching_series(
-            r_series[2], r_series[3], t_series_details
-        )
-
-        if t_series_ds_dict is not None:
-            t_series_str = "%04d-%s-%s" % (
-                t_series_ds_dict["series_num"],
-                t_series_ds_dict["modality"],
-                t_series_ds_dict["series_desc"],
-            )
-            f_series_html.writelines(
-                [
-                    "<!DOCTYPE html>\n",
-                    "<html>\n",
-                    "<body>\n",
-                    "<h1>Reference series: %s</h1>\n" % ref_series_str,
-                    "<h1>Test series: %s</h1>\n" % t_series_str,
-                    "<p>Select an instance to view differences:</p>\n",
-                    '<ol type= "1">\n',
-                ]
+            t_series_ds_dict = find_matching_series(
+                r_series[2], r_series[3], t_series_details, t_series_dict
             )
 
-            r_uids = list(r_series_ds_dict.keys())
-            # Remove the series_num, modality and series_desc keys so
-            # that the only keys in the list are SOPInstanceUIDs
-            r_uids.remove("series_num")
-            r_uids.remove("modality")
-            r_uids.remove("series_desc")
-            for instance_cnt, r_uid in enumerate(r_uids, 1):
-                progress(
-                    instance_cnt,
-                    len(r_uids),
-                    "*** comparing %d instances" % (len(r_uids)),
+            if t_series_ds_dict is not None:
+                t_series_str = "%04d-%s-%s" % (
+                    t_series_ds_dict["series_num"],
+                    t_series_ds_dict["modality"],
+                    t_series_ds_dict["series_desc"],
                 )
-
-                r_ds = r_series_ds_dict[r_uid]
-                r_inst_num = int(r_ds.get("InstanceNumber", 1))
-
-                fp_instance_html = out_dir / (r_ds.SOPInstanceUID + ".html")
-                f_series_html.writelines(
+                series_html.extend(
                     [
-                        '<li><a href="%s">%s</a></li>\n'
-                        % (str(fp_instance_html), r_ds.SOPInstanceUID)
+                        "<!DOCTYPE html>\n",
+                        "<html>\n",
+                        "<body>\n",
+                        "<h1>Reference series: %s</h1>\n" % ref_series_str,
+                        "<h1>Test series: %s</h1>\n" % t_series_str,
+                        "<p>Select an instance to view differences:</p>\n",
+                        '<ol type= "1">\n',
                     ]
                 )
 
-                t_ds = find_matching_instance(r_inst_num, t_series_ds_dict)
-
-                if t_ds is not None:
-                    rep = []
-                    for ds in [r_ds, t_ds]:
-                        if args.ignore_private:
-                            ds.remove_private_tags()
-
-                        if args.ignore_vr is not None:
-                            ds = remove_vr_tags(ds, args.ignore_vr)
-                            ds.file_meta = remove_vr_tags(ds.file_meta, args.ignore_vr)
-
-                        if args.ignore_group is not None:
-                            ds = remove_group_tags(ds, args.ignore_group)
-                            ds.file_meta = remove_group_tags(
-                                ds.file_meta, args.ignore_group
-                            )
-
-                        if args.ignore_tag:
-                            tag_to_rm_list = []
-                            for tag_to_rm in args.ignore_tag:
-                                tag_to_rm_list.append(pydicom.tag.Tag(tag_to_rm))
-
-                            ds = remove_tags(ds, tag_to_rm_list)
-                            ds.file_meta = remove_tags(ds.file_meta, tag_to_rm_list)
-
-                        if tags_to_compare is not None:
-                            ds = keep_tags(ds, tags_to_compare)
-                            ds.file_meta = keep_tags(ds.file_meta, tags_to_compare)
-
-                        rep.append(tags_to_list(ds))
-
-                    diff = difflib.HtmlDiff().make_file(
-                        rep[0],
-                        rep[1],
-                        fromdesc="Reference",
-                        todesc="Test",
-                        context=args.context,
-                        numlines=args.lines,
+                t_inst_num_dict = make_inst_num_dict(t_series_ds_dict)
+
+                # matching may ask the user to choose an instance, so is done
+                # here before the comparisons are handed to the worker processes
+                tasks = []
+                for r_uid, (r_fp, r_inst_num) in r_series_ds_dict["instances"].items():
+                    fp_instance_html = out_dir / (r_uid + ".html")
+                    series_html.append(
+                        '<li><a href="%s">%s</a></li>\n'
+                        % (str(fp_instance_html), r_uid)
                     )
 
-                    with open(fp_instance_html, "w") as f:
-                        f.writelines(diff)
-                else:
-                    f_instance_html = open(fp_instance_html, "w")
-                    f_instance_html.writelines(
-                        [
-                            "<!DOCTYPE html>\n",
-                            "<html>\n",
-                            "<body>\n",
-                            "<h1>Instance %s</h1>\n" % r_ds.SOPInstanceUID,
-                            "<p>No instance from test series found or selected for comparison</p>\n",
-                            "</body>\n",
-                            "</html>",
-                        ]
+                    t_inst = find_matching_instance(r_inst_num, t_inst_num_dict)
+                    t_fp = t_inst[0] if t_inst is not None else None
+
+                    tasks.append(
+                        (r_uid, r_fp, t_fp, out_dir, filters, meta_filters, diff_opts)
                     )
-                    f_instance_html.close()
 
-                if args.compare_one_inst:
-                    break
+                    if args.compare_one_inst:
+                        break
 
-        else:
-            f_series_html.writelines(
-                [
-                    "<!DOCTYPE html>\n",
-                    "<html>\n",
-                    "<body>\n",
-                    "<h1>Reference series: %s</h1>\n" % ref_series_str,
-                    "<p>No series from test study selected for comparison</p>\n",
-                ]
-            )
+                if len(tasks) == 1:
+                    # starting the workers takes longer than one comparison
+                    results = map(compare_instance, tasks)
+                else:
+                    results = executor.map(compare_instance, tasks, chunksize=8)
+                for instance_cnt, _ in enumerate(results, 1):
+                    progress(
+                        instance_cnt,
+                        len(tasks),
+                        "*** comparing %d instances" % (len(tasks)),
+                    )
+
+            else:
+                series_html.extend(
+                    [
+                        "<!DOCTYPE html>\n",
+                        "<html>\n",
+                        "<body>\n",
+                        "<h1>Reference series: %s</h1>\n" % ref_series_str,
+                        "<p>No series from test study selected for comparison</p>\n",
+                    ]
+                )
 
-        if t_series_ds_dict is not None:
-            f_series_html.writelines(["</ol>\n"])
+            if t_series_ds_dict is not None:
+                series_html.append("</ol>\n")
 
-        f_series_html.writelines(["</body>\n", "</html>"])
-        f_series_html.close()
+            series_html.extend(["</body>\n", "</html>"])
+            with open(fp_series_html, "w", encoding="utf-8") as f:
+                f.write("".join(series_html))
 
-    f_study_html.writelines(["</ol>\n", "</body>\n", "</html>"])
-    f_study_html.close()
+    study_html.extend(["</ol>\n", "</body>\n", "</html>"])
+    with open(fp_study_html, "w", encoding="utf-8") as f:
+        f.write("".join(study_html))
     webbrowser.open(str(fp_study_html))
 
 
@@ -1,6 +1,8 @@
 import builtins
 import copy
+import io
 import pathlib
+import sys
 import importlib.metadata
 
 import mock
@@ -15,6 +17,93 @@ TEST_DATA_DIR = THIS_DIR / "test_data"
 __version__ = importlib.metadata.version("dcmdiff")
 
 
+def sort_tags_only(ds):
+    """Copy of a dataset with only the tags dcmdiff reads when sorting"""
+    ds_sort = pydicom.dataset.Dataset()
+    for keyword in dcmdiff.SORT_TAGS:
+        if keyword in ds:
+            ds_sort.add(ds[keyword])
+
+    return ds_sort
+
+
+def clone_ds(ds):
+    """
+    Copy of a test dataset that can be changed without changing the original.
+    Each element is copied but values are shared, which is much quicker than
+    copy.deepcopy and fine as values are only ever replaced, not changed
+    """
+    ds_clone = pydicom.dataset.Dataset()
+    for elem in ds:
+        ds_clone.add(copy.copy(elem))
+
+    file_meta = getattr(ds, "file_meta", None)
+    if file_meta is not None:
+        ds_clone.file_meta = pydicom.dataset.FileMetaDataset()
+        for elem in file_meta:
+            ds_clone.file_meta.add(copy.copy(elem))
+
+    return ds_clone
+
+
+@pytest.fixture(scope="session")
+def report_ds():
+    """
+    Minimal DICOM dataset with valid file meta, built once for the session.
+    Use clone_ds to get a copy that can be changed
+    """
+    ds = pydicom.dataset.Dataset()
+    ds.StudyDate = "20220101"
+    ds.PatientBirthDate = "19800101"
+    ds.PerformedProcedureStepDescription = "MRI Head"
+    ds.PatientName = "SURNAME^Firstname"
+    ds.PatientID = "ABC12345678"
+    ds.ReferringPhysicianName = "DrSURNAME^DrFirstname"
+    ds.file_meta = pydicom.dataset.FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
+    ds.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
+    ds.file_meta.ImplementationVersionName = "report"
+    ds.file_meta.ImplementationClassUID = "1.2.3.4"
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+
+    pydicom.dataset.validate_file_meta(ds.file_meta)
+
+    return ds
+
+
+@pytest.fixture(scope="module")
+def ref_ds_template(report_ds):
+    """
+    Reference MR instance used by the command line tests, derived from
+    report_ds once for the module. Use clone_ds to get a copy that can be changed
+    """
+    ds = clone_ds(report_ds)
+    del ds.PerformedProcedureStepDescription
+    ds.SeriesDescription = "T1"
+    ds.RepetitionTime = 1000
+    ds.Modality = "MR"
+    ds.SeriesNumber = 10
+    ds.InstanceNumber = 1
+    ds.StudyInstanceUID = pydicom.uid.generate_uid()
+    ds.SeriesInstanceUID = pydicom.uid.generate_uid()
+    ds.SOPInstanceUID = pydicom.uid.generate_uid()
+
+    return ds
+
+
+@pytest.fixture(scope="module")
+def ref_dcm_bytes(ref_ds_template):
+    """
+    ref_ds_template encoded as a DICOM file, so tests that don't change it can
+    write the bytes rather than encode it again
+    """
+    with io.BytesIO() as buf:
+        ref_ds_template.save_as(
+            buf, implicit_vr=False, little_endian=True, enforce_file_format=True
+        )
+        return buf.getvalue()
+
+
 @pytest.mark.parametrize(
     "args, expected_output",
     [
@@ -29,12 +118,28 @@ def test_progress(capsys, args, expected_output):
     assert captured.out == expected_output
 
 
+def test_progress_unchanged(capsys):
+    for count in range(1, 1001):
+        dcmdiff.progress(count, 1000, "doing thing")
+
+    captured = capsys.readouterr()
+    # one line per percent, plus the final line
+    assert captured.out.count("\r") == 100
+    assert captured.out.endswith("doing thing [ 99%]\rdoing thing [100%]\n")
+
+
 @pytest.mark.parametrize(
     "test_name, expected_output",
-    [("a", "a"), ("a_b", "a_b"), (" __a^ b^__ ", "a_b"), (",.;:=%_&()_+-a", "__-a")],
+    [
+        ("a", "a"),
+        ("a_b", "a_b"),
+        (" __a^ b^__ ", "a_b"),
+        (",.;:=%_&()_+-a", "__-a"),
+        ("a/b\tc\u3000d", "a_b_c_d"),
+    ],
 )
 def test_simplify_under(test_name, expected_output):
-    assert dcmdiff.simplify_under(test_name)
+    assert dcmdiff.simplify_under(test_name) == expected_output
 
 
 @pytest.mark.parametrize(
@@ -44,6 +149,7 @@ def test_simplify_under(test_name, expected_output):
         ("a_b", "a_b"),
         (" __a^ b^__ ", "___a__b____"),
         (",.;:=%^&()_+-a", "__-a"),
+        ("a/b\tc\u3000d", "a_b_c_d"),
     ],
 )
 def test_simplify_series(test_description, expected_output):
@@ -81,10 +187,37 @@ def test_read_tag_file_no_tags(tmp_path, capsys):
 
 def test_read_tag_file(tmp_path, capsys):
     tag_to_comp_fp = tmp_path / "tags.txt"
-    tag_to_comp_fp.touch()
+    tag_to_comp_fp.write_text("RepetitionTime\n0x00100010\nEchTime\n")
 
-    with open(tag_to_comp_fp, "w") as f:
-        f.writelines(["RepetitionTime\n", "0x00100010\n", "EchTime\n"])
+    tc_list = dcmdiff.read_tag_file(tag_to_comp_fp)
+
+    assert tc_list == [("0018", "0080"), ("0010", "0010")]
+
+    # Tags (not tuples) so they can be looked up by element tag in a frozenset
+    assert all(isinstance(tag, pydicom.tag.BaseTag) for tag in tc_list)
+    assert pydicom.tag.Tag(0x00180080) in frozenset(tc_list)
+
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert (
+        captured.err
+        == "WARNING: Unable to create an element tag from 'EchTime': unknown DICOM element keyword or an invalid int\n"
+    )
+
+
+def test_read_tag_file_repeats(tmp_path, capsys):
+    tag_to_comp_fp = tmp_path / "tags.txt"
+
+    tag_to_comp_fp.write_text(
+        "RepetitionTime\n"
+        "  0x00100010 \n"
+        "\n"
+        "RepetitionTime\n"
+        "0x00180080\n"
+        "\t\n"
+        "EchTime\n"
+        "EchTime\n"
+    )
 
     tc_list = dcmdiff.read_tag_file(tag_to_comp_fp)
 
@@ -98,51 +231,40 @@ def test_read_tag_file(tmp_path, capsys):
     )
 
 
-def test_append_if_dicom(tmp_path):
+def test_append_if_dicom(tmp_path, report_ds, capsys):
     fp_not_file = tmp_path / "file_not_exist"
     fp_not_dicom = tmp_path / "not_dicom"
     fp_not_dicom.touch()
+    # DICM prefix and file meta, then a sequence that can't be parsed
+    fp_broken = tmp_path / "broken"
+    fp_broken.write_bytes(
+        b"\0" * 128
+        + b"DICM"
+        + b"\x02\x00\x10\x00UI\x14\x001.2.840.10008.1.2.1\x00"
+        + b"\x08\x00\x05\x00SQ\x00\x00\x10\x00\x00\x00"
+        + b"\xfe\xff\x00\xe0\x08\x00\x00\x00abcdefgh"
+    )
+    # DICM prefix then an element with an unknown VR
+    fp_unknown_vr = tmp_path / "unknown_vr"
+    fp_unknown_vr.write_bytes(b"\0" * 128 + b"DICM" + b"\x02\x00\x10\x00ZZ\x04\x00abcd")
 
     fp_1 = tmp_path / "test_1.dcm"
-    ds_1 = pydicom.dataset.Dataset()
-    ds_1.StudyDate = "20220101"
-    ds_1.PatientBirthDate = "19800101"
-    ds_1.PerformedProcedureStepDescription = "MRI Head"
-    ds_1.PatientName = "SURNAME^Firstname"
-    ds_1.PatientID = "ABC12345678"
-    ds_1.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_1.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_1.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_1.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_1.file_meta.ImplementationVersionName = "report"
-    ds_1.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_1.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_1.file_meta)
+    ds_1 = clone_ds(report_ds)
     ds_1.save_as(fp_1, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     fp_2 = tmp_path / "test_2.dcm"
-    ds_2 = pydicom.dataset.Dataset()
-    ds_2.StudyDate = "20220101"
-    ds_2.PatientBirthDate = "19800101"
-    ds_2.PerformedProcedureStepDescription = "MRI Head"
-    ds_2.PatientName = "SURNAME^Firstname"
+    ds_2 = clone_ds(report_ds)
     ds_2.PatientID = "EFG987654321"
-    ds_2.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_2.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_2.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
     ds_2.file_meta.MediaStorageSOPInstanceUID = "4.5.6.7"
-    ds_2.file_meta.ImplementationVersionName = "report"
-    ds_2.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_2.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_1.file_meta)
     ds_2.save_as(fp_2, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     fs = FileSet()
     fp_3 = tmp_path / "DICOMDIR"
     fs.write(tmp_path)
 
+    ds_1 = sort_tags_only(ds_1)
+    ds_2 = sort_tags_only(ds_2)
+
     # try adding a missing file
     ds_list = dcmdiff.append_if_dicom(fp_not_file, [])
     assert ds_list == []
@@ -167,6 +289,89 @@ def test_append_if_dicom(tmp_path):
     ds_list = dcmdiff.append_if_dicom(fp_1, ds_list)
     assert ds_list == [ds_1, ds_2, ds_1]
 
+    # try adding a file with a DICM prefix that can't be read
+    ds_list = dcmdiff.append_if_dicom(fp_broken, ds_list)
+    assert ds_list == [ds_1, ds_2, ds_1]
+    captured = capsys.readouterr()
+    assert captured.err.startswith("WARNING: unable to read %s: " % fp_broken)
+
+    # only errors from reading the file are caught
+    with pytest.warns(UserWarning), pytest.raises(NotImplementedError):
+        dcmdiff.append_if_dicom(fp_unknown_vr, ds_list)
+
+
+def test_past_sort_tags():
+    assert not dcmdiff.past_sort_tags(pydicom.tag.Tag("PatientID"), "LO", 10)
+    assert not dcmdiff.past_sort_tags(pydicom.tag.Tag("InstanceNumber"), "IS", 2)
+    assert dcmdiff.past_sort_tags(pydicom.tag.Tag("ImageComments"), "LT", 10)
+    assert dcmdiff.past_sort_tags(pydicom.tag.Tag("PixelData"), "OW", 1024)
+
+
+def test_load_if_dicom_not_dicom(tmp_path):
+    # files without the DICM prefix are rejected without being parsed
+    fp_not_dicom = tmp_path / "not_dicom"
+    fp_not_dicom.write_bytes(b"\0" * 1024)
+
+    with mock.patch.object(pydicom, "dcmread") as mock_dcmread:
+        assert dcmdiff.load_if_dicom(fp_not_dicom) is None
+        mock_dcmread.assert_not_called()
+
+
+def test_list_files(tmp_path):
+    for fp in [
+        "b.dcm",
+        "a.dcm",
+        ".c.dcm",
+        "d/e.dcm",
+        "d/.f/g.dcm",
+        ".h/i.dcm",
+        "j/k/l.dcm",
+        "j/k/m",
+        "j/k/n.JPG",
+        "j/k/o.txt",
+        "j/DICOMDIR",
+    ]:
+        (tmp_path / fp).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / fp).touch()
+
+    assert dcmdiff.list_files(tmp_path) == [
+        tmp_path / "a.dcm",
+        tmp_path / "b.dcm",
+        tmp_path / "d" / "e.dcm",
+        tmp_path / "j" / "k" / "l.dcm",
+        tmp_path / "j" / "k" / "m",
+    ]
+
+
+def test_list_files_order(tmp_path, report_ds):
+    # DICOM files both in sub-directories and at the top level
+    fp_list = ["s1_2.dcm", "a/s1_1.dcm", "s3.dcm", "b/s2_1.dcm"]
+    for counter, fp in enumerate(fp_list):
+        (tmp_path / fp).parent.mkdir(exist_ok=True)
+        ds = clone_ds(report_ds)
+        ds.PatientID = str(counter)
+        ds.save_as(
+            tmp_path / fp,
+            implicit_vr=False,
+            little_endian=True,
+            enforce_file_format=True,
+        )
+
+    # files are listed in the same order as sorted(rglob), not directory by
+    # directory
+    assert dcmdiff.list_files(tmp_path) == [
+        tmp_path / "a" / "s1_1.dcm",
+        tmp_path / "b" / "s2_1.dcm",
+        tmp_path / "s1_2.dcm",
+        tmp_path / "s3.dcm",
+    ]
+    assert dcmdiff.list_files(tmp_path) == [
+        fp for fp in sorted(tmp_path.rglob("*")) if fp.is_file()
+    ]
+
+    ds_list = dcmdiff.make_ds_list(tmp_path, threads=True)
+    assert [ds.PatientID for ds in ds_list] == ["1", "3", "0", "2"]
+
 
 def test_make_ds_list_error_1(tmp_path, capsys):
     fp_not_dicom = tmp_path / "not_dicom"
@@ -197,74 +402,51 @@ def test_make_ds_list_error_2(tmp_path, capsys):
     assert captured.err == "ERROR: %s is neither a file or directory\n" % fp_not_file
 
 
-def test_make_ds_list_file(tmp_path):
+def test_make_ds_list_file(tmp_path, report_ds):
     fp_1 = tmp_path / "test_1.dcm"
-    ds_1 = pydicom.dataset.Dataset()
-    ds_1.StudyDate = "20220101"
-    ds_1.PatientBirthDate = "19800101"
-    ds_1.PerformedProcedureStepDescription = "MRI Head"
-    ds_1.PatientName = "SURNAME^Firstname"
-    ds_1.PatientID = "ABC12345678"
-    ds_1.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_1.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_1.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_1.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_1.file_meta.ImplementationVersionName = "report"
-    ds_1.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_1.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_1.file_meta)
+    ds_1 = clone_ds(report_ds)
     ds_1.save_as(fp_1, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     ds_list = dcmdiff.make_ds_list(fp_1)
-    assert ds_list == [ds_1]
+    assert ds_list == [sort_tags_only(ds_1)]
+    assert "PatientBirthDate" not in ds_list[0]
 
 
-def test_make_ds_list_dir(tmp_path):
+def test_make_ds_list_dir(tmp_path, report_ds):
     test_dir = tmp_path / "dir1"
     test_dir.mkdir()
 
     fp_1 = test_dir / "test_1.dcm"
-    ds_1 = pydicom.dataset.Dataset()
-    ds_1.StudyDate = "20220101"
-    ds_1.PatientBirthDate = "19800101"
-    ds_1.PerformedProcedureStepDescription = "MRI Head"
-    ds_1.PatientName = "SURNAME^Firstname"
-    ds_1.PatientID = "ABC12345678"
-    ds_1.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_1.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_1.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_1.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_1.file_meta.ImplementationVersionName = "report"
-    ds_1.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_1.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_1.file_meta)
+    ds_1 = clone_ds(report_ds)
     ds_1.save_as(fp_1, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     fp_2 = test_dir / "test_2.dcm"
-    ds_2 = pydicom.dataset.Dataset()
-    ds_2.StudyDate = "20220101"
-    ds_2.PatientBirthDate = "19800101"
-    ds_2.PerformedProcedureStepDescription = "MRI Head"
-    ds_2.PatientName = "SURNAME^Firstname"
+    ds_2 = clone_ds(report_ds)
     ds_2.PatientID = "EFG987654321"
-    ds_2.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_2.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_2.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
     ds_2.file_meta.MediaStorageSOPInstanceUID = "4.5.6.7"
-    ds_2.file_meta.ImplementationVersionName = "report"
-    ds_2.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_2.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_1.file_meta)
     ds_2.save_as(fp_2, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     fs = FileSet()
     fs.write(test_dir)
 
+    # files that aren't DICOM are skipped
+    (test_dir / "not_dicom").touch()
+
+    # DICOM files in hidden directories are skipped
+    hidden_dir = test_dir / ".hidden"
+    hidden_dir.mkdir()
+    ds_1.save_as(
+        hidden_dir / "test_3.dcm",
+        implicit_vr=False,
+        little_endian=True,
+        enforce_file_format=True,
+    )
+
     ds_list = dcmdiff.make_ds_list(test_dir)
-    assert ds_list == [ds_1, ds_2]
+    assert ds_list == [sort_tags_only(ds_1), sort_tags_only(ds_2)]
+
+    ds_list = dcmdiff.make_ds_list(test_dir, threads=True)
+    assert ds_list == [sort_tags_only(ds_1), sort_tags_only(ds_2)]
 
 
 def test_sort_ds_list():
@@ -282,22 +464,25 @@ def test_sort_ds_list():
     ds_1.SeriesInstanceUID = pydicom.uid.generate_uid()
     ds_1.SeriesNumber = 1
     ds_1.InstanceNumber = 1
+    ds_1.filename = "01.dcm"
 
     # Patient 1, Study A, Series 1, Instance 2
-    ds_2 = copy.deepcopy(ds_1)
+    ds_2 = clone_ds(ds_1)
     ds_2.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_2.InstanceNumber = 2
+    ds_2.filename = "02.dcm"
 
     # Patient 1, Study A, Series 7, Instance 43
-    ds_3 = copy.deepcopy(ds_1)
+    ds_3 = clone_ds(ds_1)
     ds_3.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_3.SeriesDescription = "Tissue"
     ds_3.SeriesInstanceUID = pydicom.uid.generate_uid()
     ds_3.SeriesNumber = 7
     ds_3.InstanceNumber = 43
+    ds_3.filename = "03.dcm"
 
     # Patient 1, Study B, Series 9, Instance 76
-    ds_4 = copy.deepcopy(ds_1)
+    ds_4 = clone_ds(ds_1)
     ds_4.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_4.StudyTime = "121500.000000"
     ds_4.Modality = "MR"
@@ -307,6 +492,7 @@ def test_sort_ds_list():
     ds_4.SeriesInstanceUID = pydicom.uid.generate_uid()
     ds_4.SeriesNumber = 9
     ds_4.InstanceNumber = 76
+    ds_4.filename = "04.dcm"
 
     # Patient 2, Study C, Series 10, Instance 96
     ds_5 = pydicom.dataset.Dataset()
@@ -322,6 +508,7 @@ def test_sort_ds_list():
     ds_5.SeriesInstanceUID = pydicom.uid.generate_uid()
     ds_5.SeriesNumber = 10
     ds_5.InstanceNumber = 96
+    ds_5.filename = "05.dcm"
 
     # note ds_2 is a repeat SOPInstance so it won't end up in the dict
     ds_dict = dcmdiff.sort_ds_list([ds_1, ds_2, ds_2, ds_3, ds_4, ds_5])
@@ -335,44 +522,70 @@ def test_sort_ds_list():
     ref_ds_dict = {
         ds_1.PatientID: {
             "patient_name": clean_pt_name_1,
-            ds_1.StudyInstanceUID: {
-                "study_datetime": "20220101.120000",
-                "study_desc": dcmdiff.simplify_series(ds_1.StudyDescription),
-                ds_1.SeriesInstanceUID: {
-                    "series_num": int(ds_1.SeriesNumber),
-                    "modality": ds_1.Modality,
-                    "series_desc": dcmdiff.simplify_series(ds_1.SeriesDescription),
-                    ds_1.SOPInstanceUID: ds_1,
-                    ds_2.SOPInstanceUID: ds_2,
-                },
-                ds_3.SeriesInstanceUID: {
-                    "series_num": int(ds_3.SeriesNumber),
-                    "modality": ds_3.Modality,
-                    "series_desc": dcmdiff.simplify_series(ds_3.SeriesDescription),
-                    ds_3.SOPInstanceUID: ds_3,
+            "studies": {
+                ds_1.StudyInstanceUID: {
+                    "study_datetime": "20220101.120000",
+                    "study_desc": dcmdiff.simplify_series(ds_1.StudyDescription),
+                    "series": {
+                        ds_1.SeriesInstanceUID: {
+                            "series_num": int(ds_1.SeriesNumber),
+                            "modality": ds_1.Modality,
+                            "series_desc": dcmdiff.simplify_series(
+                                ds_1.SeriesDescription
+                            ),
+                            "instances": {
+                                ds_1.SOPInstanceUID: ("01.dcm", 1),
+                                ds_2.SOPInstanceUID: ("02.dcm", 2),
+                            },
+                        },
+                        ds_3.SeriesInstanceUID: {
+                            "series_num": int(ds_3.SeriesNumber),
+                            "modality": ds_3.Modality,
+                            "series_desc": dcmdiff.simplify_series(
+                                ds_3.SeriesDescription
+                            ),
+                            "instances": {
+                                ds_3.SOPInstanceUID: ("03.dcm", 43),
+                            },
+                        },
+                    },
                 },
-            },
-            ds_4.StudyInstanceUID: {
-                "study_datetime": "20220101.121500",
-                "study_desc": dcmdiff.simplify_series(ds_4.StudyDescription),
-                ds_4.SeriesInstanceUID: {
-                    "series_num": int(ds_4.SeriesNumber),
-                    "modality": ds_4.Modality,
-                    "series_desc": dcmdiff.simplify_series(ds_4.SeriesDescription),
-                    ds_4.SOPInstanceUID: ds_4,
+                ds_4.StudyInstanceUID: {
+                    "study_datetime": "20220101.121500",
+                    "study_desc": dcmdiff.simplify_series(ds_4.StudyDescription),
+                    "series": {
+                        ds_4.SeriesInstanceUID: {
+                            "series_num": int(ds_4.SeriesNumber),
+                            "modality": ds_4.Modality,
+                            "series_desc": dcmdiff.simplify_series(
+                                ds_4.SeriesDescription
+                            ),
+                            "instances": {
+                                ds_4.SOPInstanceUID: ("04.dcm", 76),
+                            },
+                        },
+                    },
                 },
             },
         },
         ds_5.PatientID: {
             "patient_name": clean_pt_name_2,
-            ds_5.StudyInstanceUID: {
-                "study_datetime": "20220101.120000",
-                "study_desc": dcmdiff.simplify_series(ds_5.StudyDescription),
-                ds_5.SeriesInstanceUID: {
-                    "series_num": int(ds_5.SeriesNumber),
-                    "modality": ds_5.Modality,
-                    "series_desc": dcmdiff.simplify_series(ds_5.SeriesDescription),
-                    ds_5.SOPInstanceUID: ds_5,
+            "studies": {
+                ds_5.StudyInstanceUID: {
+                    "study_datetime": "20220101.120000",
+                    "study_desc": dcmdiff.simplify_series(ds_5.StudyDescription),
+                    "series": {
+                        ds_5.SeriesInstanceUID: {
+                            "series_num": int(ds_5.SeriesNumber),
+                            "modality": ds_5.Modality,
+                            "series_desc": dcmdiff.simplify_series(
+                                ds_5.SeriesDescription
+                            ),
+                            "instances": {
+                                ds_5.SOPInstanceUID: ("05.dcm", 96),
+                            },
+                        },
+                    },
                 },
             },
         },
@@ -402,7 +615,12 @@ def test_get_patient_ds_dict_2pat(capsys):
 def test_get_study_ds_dict_1study():
     ds_dict = {
         "patient_name": "surname-firstname",
-        "1.2.3.4.5.6": {"study_datetime": "20220101.120000", "study_desc": "study_a"},
+        "studies": {
+            "1.2.3.4.5.6": {
+                "study_datetime": "20220101.120000",
+                "study_desc": "study_a",
+            },
+        },
     }
     assert dcmdiff.get_study_ds_dict(ds_dict) == {
         "study_datetime": "20220101.120000",
@@ -413,8 +631,16 @@ def test_get_study_ds_dict_1study():
 def test_get_study_ds_dict_2study(capsys):
     ds_dict = {
         "patient_name": "surname-firstname",
-        "1.2.3.4.5.6": {"study_datetime": "20220101.120000", "study_desc": "study_a"},
-        "5.6.7.7.9.10": {"study_datetime": "20220202.130000", "study_desc": "study_b"},
+        "studies": {
+            "1.2.3.4.5.6": {
+                "study_datetime": "20220101.120000",
+                "study_desc": "study_a",
+            },
+            "5.6.7.7.9.10": {
+                "study_datetime": "20220202.130000",
+                "study_desc": "study_b",
+            },
+        },
     }
 
     with mock.patch.object(builtins, "input", lambda _: "1"):
@@ -460,7 +686,7 @@ def test_get_all_series_details(tmp_path):
     ds_1.save_as(fp_1, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     # Patient 1, Study A, Series 1, Instance 2
-    ds_2 = copy.deepcopy(ds_1)
+    ds_2 = clone_ds(ds_1)
     ds_2.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_2.InstanceNumber = 2
 
@@ -468,7 +694,7 @@ def test_get_all_series_details(tmp_path):
     ds_2.save_as(fp_2, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     # Patient 1, Study A, Series 7, Instance 43
-    ds_3 = copy.deepcopy(ds_1)
+    ds_3 = clone_ds(ds_1)
     ds_3.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_3.SeriesDescription = "Tissue"
     ds_3.SeriesInstanceUID = pydicom.uid.generate_uid()
@@ -490,8 +716,10 @@ def test_get_all_series_details(tmp_path):
                 "series_num": ds_1.SeriesNumber,
                 "modality": ds_1.Modality,
                 "series_desc": ds_1.SeriesDescription,
-                ds_1.SOPInstanceUID: ds_1,
-                ds_2.SOPInstanceUID: ds_2,
+                "instances": {
+                    ds_1.SOPInstanceUID: (str(fp_1), 1),
+                    ds_2.SOPInstanceUID: (str(fp_2), 2),
+                },
             },
         ),
         (
@@ -503,7 +731,9 @@ def test_get_all_series_details(tmp_path):
                 "series_num": ds_3.SeriesNumber,
                 "modality": ds_3.Modality,
                 "series_desc": ds_3.SeriesDescription,
-                ds_3.SOPInstanceUID: ds_3,
+                "instances": {
+                    ds_3.SOPInstanceUID: (str(fp_3), 43),
+                },
             },
         ),
     ]
@@ -522,8 +752,10 @@ def test_choose_series(capsys):
                 "series_num": 1,
                 "modality": "MR",
                 "series_desc": "T1",
-                "A.B.C.D.E": "ds1",
-                "F.G.H.I.J": "ds2",
+                "instances": {
+                    "A.B.C.D.E": "ds1",
+                    "F.G.H.I.J": "ds2",
+                },
             },
         ),
         (
@@ -535,7 +767,9 @@ def test_choose_series(capsys):
                 "series_num": 2000,
                 "modality": "DOC",
                 "series_desc": "Results",
-                "K.L.M.N.O": "ds2",
+                "instances": {
+                    "K.L.M.N.O": "ds2",
+                },
             },
         ),
     ]
@@ -550,7 +784,9 @@ def test_choose_series(capsys):
             "series_num": 2000,
             "modality": "DOC",
             "series_desc": "Results",
-            "K.L.M.N.O": "ds2",
+            "instances": {
+                "K.L.M.N.O": "ds2",
+            },
         }
 
     with mock.patch.object(builtins, "input", lambda _: "n"):
@@ -572,8 +808,10 @@ def test_find_matching_series(capsys):
                 "series_num": 1,
                 "modality": "MR",
                 "series_desc": "T1",
-                "A.B.C.D.E": "ds1",
-                "F.G.H.I.J": "ds2",
+                "instances": {
+                    "A.B.C.D.E": "ds1",
+                    "F.G.H.I.J": "ds2",
+                },
             },
         ),
         (
@@ -585,7 +823,9 @@ def test_find_matching_series(capsys):
                 "series_num": 2000,
                 "modality": "DOC",
                 "series_desc": "Results",
-                "K.L.M.N.O": "ds2",
+                "instances": {
+                    "K.L.M.N.O": "ds2",
+                },
             },
         ),
     ]
@@ -604,14 +844,18 @@ def test_find_matching_series(capsys):
             "series_num": 2000,
             "modality": "DOC",
             "series_desc": "Results",
-            "K.L.M.N.O": "ds2",
+            "instances": {
+                "K.L.M.N.O": "ds2",
+            },
         }
 
     assert dcmdiff.find_matching_series("DOC", "Results", series_list) == {
         "series_num": 2000,
         "modality": "DOC",
         "series_desc": "Results",
-        "K.L.M.N.O": "ds2",
+        "instances": {
+            "K.L.M.N.O": "ds2",
+        },
     }
 
     series_list.append(
@@ -624,7 +868,9 @@ def test_find_matching_series(capsys):
                 "series_num": 3000,
                 "modality": "DOC",
                 "series_desc": "Results",
-                "K.L.M.N.O": "ds3",
+                "instances": {
+                    "K.L.M.N.O": "ds3",
+                },
             },
         ),
     )
@@ -643,87 +889,195 @@ def test_find_matching_series(capsys):
             "series_num": 3000,
             "modality": "DOC",
             "series_desc": "Results",
-            "K.L.M.N.O": "ds3",
+            "instances": {
+                "K.L.M.N.O": "ds3",
+            },
         }
 
+    # a prebuilt dictionary is used in place of the list
+    series_dict = dcmdiff.make_series_dict(series_list[:2])
+    assert (
+        dcmdiff.find_matching_series("DOC", "Results", series_list, series_dict)
+        == series_list[1][4]
+    )
 
-def test_choose_instance(capsys):
-    ds_1 = pydicom.dataset.Dataset()
-    ds_1.InstanceNumber = 1
 
-    ds_2 = pydicom.dataset.Dataset()
-    ds_2.InstanceNumber = 2
+def test_make_series_dict():
+    ser_1 = ("1.2.3.4.5", 1, "MR", "T1", {})
+    ser_2 = ("2.3.4.5.6", 2, "MR", "T2", {})
+    ser_3 = ("3.4.5.6.7", 3, "MR", "T1", {})
+
+    series_dict = dcmdiff.make_series_dict([ser_1, ser_2, ser_3])
+    assert series_dict == {("MR", "T1"): [ser_1, ser_3], ("MR", "T2"): [ser_2]}
 
-    ds_3 = pydicom.dataset.Dataset()
-    ds_3.InstanceNumber = 3
 
-    instance_list = [ds_1, ds_2, ds_3]
+def test_choose_instance(capsys):
+    instance_list = [("01.dcm", 1), ("02.dcm", 2), ("03.dcm", 3)]
 
     with mock.patch.object(builtins, "input", lambda _: "1"):
-        ds_test = dcmdiff.choose_instance(instance_list)
+        inst_test = dcmdiff.choose_instance(instance_list)
         captured = capsys.readouterr()
         assert "   0 - instance number 0001" in captured.out
         assert "   1 - instance number 0002" in captured.out
         assert "   2 - instance number 0003" in captured.out
 
-        assert ds_test == ds_2
+        assert inst_test == ("02.dcm", 2)
 
     with mock.patch.object(builtins, "input", lambda _: "n"):
-        ds_test = dcmdiff.choose_instance(instance_list)
+        inst_test = dcmdiff.choose_instance(instance_list)
         captured = capsys.readouterr()
         assert "   0 - instance number 0001" in captured.out
         assert "   1 - instance number 0002" in captured.out
         assert "   2 - instance number 0003" in captured.out
-        assert not ds_test
+        assert not inst_test
 
 
-def test_find_matching_instance(capsys):
-    ds_1 = pydicom.dataset.Dataset()
-    ds_1.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_1.InstanceNumber = 1
+def test_choose_instance_piped(capsys):
+    instance_list = [("01.dcm", 1), ("02.dcm", 2)]
 
-    ds_2 = pydicom.dataset.Dataset()
-    ds_2.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_2.InstanceNumber = 1
+    # answer read from a pipe rather than a terminal, the instruction is on
+    # its own line and the prompt is left for the output that follows
+    with mock.patch.object(sys, "stdin", io.StringIO("1\n")):
+        inst_test = dcmdiff.choose_instance(instance_list)
+        print("** next")
 
-    ds_3 = pydicom.dataset.Dataset()
-    ds_3.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_3.InstanceNumber = 3
+    captured = capsys.readouterr()
+    assert captured.out == (
+        "   0 - instance number 0001\n"
+        "   1 - instance number 0002\n"
+        "select one instance (n=none):\n"
+        "? ** next\n"
+    )
+    assert inst_test == ("02.dcm", 2)
 
-    # case where no matches but only one instance in test series
-    test_uid_dict = {
+
+def test_make_inst_num_dict():
+    inst_1 = ("01.dcm", 1)
+    inst_2 = ("02.dcm", 1)
+    inst_3 = ("03.dcm", 3)
+
+    series_ds_dict = {
         "series_num": 1,
         "modality": "MR",
         "series_desc": "T1",
-        ds_1.SOPInstanceUID: ds_1,
+        "instances": {
+            "1.2.3.4.1": inst_1,
+            "1.2.3.4.2": inst_2,
+            "1.2.3.4.3": inst_3,
+        },
     }
-    ds_result = dcmdiff.find_matching_instance(4, test_uid_dict)
-    assert ds_result == ds_1
+
+    inst_num_dict = dcmdiff.make_inst_num_dict(series_ds_dict)
+    assert inst_num_dict == {1: [inst_1, inst_2], 3: [inst_3]}
+
+
+def test_find_matching_instance(capsys):
+    inst_1 = ("01.dcm", 1)
+    inst_2 = ("02.dcm", 1)
+    inst_3 = ("03.dcm", 3)
+
+    # case where no matches but only one instance in test series
+    inst_num_dict = {1: [inst_1]}
+    inst_result = dcmdiff.find_matching_instance(4, inst_num_dict)
+    assert inst_result == inst_1
 
     # case where no matches and multiple instances in test series
-    test_uid_dict = {
-        "series_num": 1,
-        "modality": "MR",
-        "series_desc": "T1",
-        ds_1.SOPInstanceUID: ds_1,
-        ds_2.SOPInstanceUID: ds_2,
-        ds_3.SOPInstanceUID: ds_3,
-    }
+    inst_num_dict = {1: [inst_1, inst_2], 3: [inst_3]}
 
-    ds_result_2 = dcmdiff.find_matching_instance(4, test_uid_dict)
-    assert not ds_result_2
+    inst_result_2 = dcmdiff.find_matching_instance(4, inst_num_dict)
+    assert not inst_result_2
+
+    # case where no matches and multiple instances with the same number
+    assert not dcmdiff.find_matching_instance(4, {1: [inst_1, inst_2]})
 
     # case with one match
-    ds_result_3 = dcmdiff.find_matching_instance(3, test_uid_dict)
-    assert ds_result_3 == ds_3
+    inst_result_3 = dcmdiff.find_matching_instance(3, inst_num_dict)
+    assert inst_result_3 == inst_3
 
     # case with multiple matches
     with mock.patch.object(builtins, "input", lambda _: "1"):
-        ds_result_4 = dcmdiff.find_matching_instance(1, test_uid_dict)
+        inst_result_4 = dcmdiff.find_matching_instance(1, inst_num_dict)
         captured = capsys.readouterr()
         assert "   0 - instance number 0001" in captured.out
         assert "   1 - instance number 0001" in captured.out
-        assert ds_result_4 == ds_2
+        assert inst_result_4 == inst_2
+
+
+def test_filter_ds():
+    ds_1 = pydicom.dataset.Dataset()
+    ds_1.SOPInstanceUID = pydicom.uid.generate_uid()
+    ds_1.StudyDate = "20220101"
+    ds_1.Modality = "CT"
+    ds_1.PatientName = "SURNAME^Firstname"
+    ds_1.PatientID = "ABC1234567"
+    ds_1.SeriesNumber = 1
+    ds_1.InstanceNumber = 1
+    ds_1.add_new(0x00291010, "LO", "private")
+    ref_item = pydicom.dataset.Dataset()
+    ref_item.ReferencedSOPInstanceUID = pydicom.uid.generate_uid()
+    ref_item.PatientID = "ABC1234567"
+    ds_1.ReferencedImageSequence = [ref_item]
+
+    ds_1 = dcmdiff.filter_ds(
+        ds_1,
+        tags_to_rm=[pydicom.tag.Tag("Modality")],
+        vrs_to_remove=["UI"],
+        groups_to_remove=[0x0010],
+        remove_private=True,
+    )
+
+    ds_filtered_ref = pydicom.dataset.Dataset()
+    ds_filtered_ref.StudyDate = "20220101"
+    ds_filtered_ref.SeriesNumber = 1
+    ds_filtered_ref.InstanceNumber = 1
+    ds_filtered_ref.ReferencedImageSequence = [pydicom.dataset.Dataset()]
+
+    assert ds_1 == ds_filtered_ref
+
+    # no filters so dataset is unchanged
+    assert dcmdiff.filter_ds(ds_1) == ds_filtered_ref
+
+
+def test_make_file_meta_filters():
+    filters = {
+        "tags_to_keep": None,
+        "tags_to_rm": frozenset(
+            [pydicom.tag.Tag("PatientID"), pydicom.tag.Tag("TransferSyntaxUID")]
+        ),
+        "vrs_to_remove": frozenset(["UI"]),
+        "groups_to_remove": frozenset([0x0002, 0x0010]),
+        "remove_private": True,
+    }
+
+    assert dcmdiff.make_file_meta_filters(filters) == {
+        "tags_to_keep": None,
+        "tags_to_rm": frozenset([pydicom.tag.Tag("TransferSyntaxUID")]),
+        "vrs_to_remove": frozenset(["UI"]),
+        "groups_to_remove": frozenset([0x0002]),
+        "remove_private": False,
+    }
+
+    # nothing that can match file meta information
+    filters = {
+        "tags_to_keep": None,
+        "tags_to_rm": frozenset([pydicom.tag.Tag("PatientID")]),
+        "vrs_to_remove": None,
+        "groups_to_remove": None,
+        "remove_private": True,
+    }
+    meta_filters = dcmdiff.make_file_meta_filters(filters)
+
+    file_meta = pydicom.dataset.FileMetaDataset()
+    file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
+    with mock.patch.object(file_meta, "walk") as mock_walk:
+        assert dcmdiff.filter_ds(file_meta, **meta_filters) is file_meta
+        mock_walk.assert_not_called()
+
+    # keeping tags still applies to file meta information
+    filters = {"tags_to_keep": frozenset([pydicom.tag.Tag("PatientID")])}
+    assert dcmdiff.make_file_meta_filters(filters)["tags_to_keep"] == frozenset(
+        [pydicom.tag.Tag("PatientID")]
+    )
 
 
 def test_keep_tags():
@@ -813,7 +1167,7 @@ def test_remove_group_tags():
     ds_1.SeriesNumber = 1
     ds_1.InstanceNumber = 1
 
-    ds_1 = dcmdiff.remove_group_tags(ds_1, ["0x0010", "0x0020"])
+    ds_1 = dcmdiff.remove_group_tags(ds_1, [0x0010, 0x0020])
 
     ds_without_group10_20_ref = pydicom.dataset.Dataset()
     ds_without_group10_20_ref.SOPInstanceUID = ds_1.SOPInstanceUID
@@ -848,8 +1202,219 @@ def test_tags_to_list():
     assert tag_list == ref_tag_list
 
 
+def test_elem_to_str():
+    elem = pydicom.dataelem.DataElement(0x00100010, "PN", "SURNAME^Firstname")
+    assert dcmdiff.elem_to_str(elem) == str(elem)
+    assert dcmdiff.elem_to_str(elem, "   ") == "   " + str(elem)
+
+    assert dcmdiff.elem_names[0x00100010] == "Patient's Name"
+
+    # private element names depend on the private creator so aren't cached
+    elem = pydicom.dataelem.DataElement(0x00291010, "LO", "")
+    assert dcmdiff.elem_to_str(elem) == str(elem)
+    assert 0x00291010 not in dcmdiff.elem_names
+
+    elem.private_creator = "SIEMENS CSA HEADER"
+    assert dcmdiff.elem_to_str(elem) == str(elem)
+    assert "[CSA Image Header Info]" in dcmdiff.elem_to_str(elem)
+
+    elem.showVR = False
+    assert dcmdiff.elem_to_str(elem) == str(elem)
+
+
+def test_tags_to_list_matches_str():
+    ds = pydicom.dataset.Dataset()
+    assert dcmdiff.tags_to_list(ds) == []
+
+    ds.file_meta = pydicom.dataset.FileMetaDataset()
+    ds.file_meta.MediaStorageSOPInstanceUID = "1.2.3"
+    ds.PatientName = ["SURNAME\nFirstname", "OTHER\r"]
+    item = pydicom.dataset.Dataset()
+    item.ReferencedSOPInstanceUID = "1.2.3.4"
+    item.ReferencedImageSequence = [pydicom.dataset.Dataset()]
+    ds.ReferencedImageSequence = [item, pydicom.dataset.Dataset()]
+
+    tag_list = dcmdiff.tags_to_list(ds)
+
+    assert tag_list == str(ds).splitlines(keepends=True)
+    assert tag_list[0] == "Dataset.file_meta -------------------------------\n"
+
+
+def test_make_html_diff():
+    ref = ["a\n", "b\n", "c\n", "d\n", "e <f>"]
+    test = ["a\n", "b\n", "c\n", "x\n", "e <f>"]
+
+    # side-by-side table
+    diff = dcmdiff.make_html_diff(ref, test, "Reference", "Test", True, 1)
+    assert '<table class="diff"' in diff
+
+    # unified diff with one line of context
+    diff = dcmdiff.make_html_diff(ref, test, "Reference", "Test", True, 1, unified=True)
+    assert diff.startswith("<!DOCTYPE html>\n")
+    assert diff.endswith("</html>")
+    assert (
+        "<pre>\n"
+        '<span class="file">--- Reference</span>\n'
+        '<span class="file">+++ Test</span>\n'
+        '<span class="hunk">@@ -3,3 +3,3 @@</span>\n'
+        " c\n"
+        '<span class="sub">-d</span>\n'
+        '<span class="add">+x</span>\n'
+        " e &lt;f&gt;\n"
+        "</pre>\n"
+    ) in diff
+
+    # unified diff showing the full files
+    diff = dcmdiff.make_html_diff(
+        ref, test, "Reference", "Test", False, 1, unified=True
+    )
+    assert '<span class="hunk">@@ -1,5 +1,5 @@</span>\n a\n b\n c\n' in diff
+
+    # unified diff with no differences
+    diff = dcmdiff.make_html_diff(ref, ref, "Reference", "Test", True, 1, unified=True)
+    assert "<pre>\nNo Differences Found\n</pre>\n" in diff
+
+    # removed separator lines are marked as removed, not as file headers
+    ds_r = pydicom.dataset.Dataset()
+    ds_r.file_meta = pydicom.dataset.FileMetaDataset()
+    ds_r.file_meta.MediaStorageSOPClassUID = "1.2.3"
+    ds_r.PatientID = "ABC12345678"
+    ds_t = pydicom.dataset.Dataset()
+    ds_t.PatientID = "ABC12345678"
+    diff = dcmdiff.make_html_diff(
+        dcmdiff.tags_to_list(ds_r),
+        dcmdiff.tags_to_list(ds_t),
+        "Reference",
+        "Test",
+        True,
+        1,
+        unified=True,
+    )
+    assert '<span class="sub">-Dataset.file_meta -----' in diff
+    assert '<span class="sub">--------' in diff
+    assert diff.count('<span class="file">') == 2
+
+
 SCRIPT_NAME = "dcmdiff"
 SCRIPT_USAGE = f"usage: {SCRIPT_NAME} [-h]"
+HTML_HEAD = "<!DOCTYPE html>\n<html>\n<body>\n"
+HTML_TAIL = "</body>\n</html>"
+STUDY_HTML_HEAD = (
+    HTML_HEAD
+    + "<h1>DICOM Study</h1>\n"
+    + "<p>Select a reference series to view differences:</p>\n"
+    + '<ol type= "1">\n'
+)
+
+
+def test_compare_instance(tmp_path, report_ds):
+    fp_r = tmp_path / "ref.dcm"
+    ds_r = clone_ds(report_ds)
+    ds_r.RepetitionTime = "1000"
+    ds_r.add_new(0x00291010, "LO", "private")
+    r_uid = pydicom.uid.generate_uid()
+    ds_r.SOPInstanceUID = r_uid
+    ds_r.save_as(fp_r, implicit_vr=False, little_endian=True, enforce_file_format=True)
+
+    fp_t = tmp_path / "test.dcm"
+    ds_t = clone_ds(ds_r)
+    ds_t.RepetitionTime = "2000"
+    ds_t.PatientID = "XYZ"
+    ds_t.save_as(fp_t, implicit_vr=False, little_endian=True, enforce_file_format=True)
+
+    filters = {
+        "tags_to_keep": None,
+        "tags_to_rm": frozenset([pydicom.tag.Tag("PatientID")]),
+        "vrs_to_remove": None,
+        "groups_to_remove": None,
+        "remove_private": True,
+    }
+    meta_filters = dcmdiff.make_file_meta_filters(filters)
+    diff_opts = {"context": True, "numlines": 1, "unified": True}
+
+    fp_html = dcmdiff.compare_instance(
+        (
+            r_uid,
+            str(fp_r),
+            str(fp_t),
+            tmp_path,
+            filters,
+            meta_filters,
+            diff_opts,
+        )
+    )
+
+    assert fp_html == tmp_path / (r_uid + ".html")
+    html = fp_html.read_text(encoding="utf-8")
+    assert (
+        "-(0018,0080) Repetition Time                     DS: &#x27;1000&#x27;" in html
+    )
+    assert (
+        "+(0018,0080) Repetition Time                     DS: &#x27;2000&#x27;" in html
+    )
+    assert "Patient ID" not in html
+    assert "private" not in html
+
+    # no matching instance in the test series
+    fp_html = dcmdiff.compare_instance(
+        (
+            r_uid,
+            str(fp_r),
+            None,
+            tmp_path,
+            filters,
+            meta_filters,
+            diff_opts,
+        )
+    )
+
+    assert fp_html.read_text(encoding="utf-8") == (
+        HTML_HEAD
+        + "<h1>Instance %s</h1>\n" % r_uid
+        + "<p>No instance from test series found or selected for comparison</p>\n"
+        + HTML_TAIL
+    )
+
+
+def test_compare_instance_filters_each(tmp_path, report_ds):
+    # instances in the same series can have different elements, so what is
+    # removed from the reference can't be reused for the test
+    fp_r = tmp_path / "ref.dcm"
+    ds_r = clone_ds(report_ds)
+    r_uid = pydicom.uid.generate_uid()
+    ds_r.SOPInstanceUID = r_uid
+    ds_r.save_as(fp_r, implicit_vr=False, little_endian=True, enforce_file_format=True)
+
+    fp_t = tmp_path / "test.dcm"
+    ds_t = clone_ds(ds_r)
+    ds_t.add_new(0x00291010, "LO", "private")
+    ds_t.ImageComments = "comment"
+    ds_t.save_as(fp_t, implicit_vr=False, little_endian=True, enforce_file_format=True)
+
+    filters = {
+        "tags_to_keep": None,
+        "tags_to_rm": None,
+        "vrs_to_remove": frozenset(["LT"]),
+        "groups_to_remove": None,
+        "remove_private": True,
+    }
+    diff_opts = {"context": True, "numlines": 1, "unified": True}
+
+    fp_html = dcmdiff.compare_instance(
+        (
+            r_uid,
+            str(fp_r),
+            str(fp_t),
+            tmp_path,
+            filters,
+            dcmdiff.make_file_meta_filters(filters),
+            diff_opts,
+        )
+    )
+
+    assert "<pre>\nNo Differences Found\n</pre>\n" in fp_html.read_text(
+        encoding="utf-8"
+    )
 
 
 def test_prints_help_1(script_runner):
@@ -877,42 +1442,75 @@ def test_prints_version(script_runner):
     assert result.stdout == expected_version_output
 
 
-def test_dcmdiff_single_files(tmp_path, script_runner):
+@pytest.mark.parametrize(
+    "tags, extra_args, names_in, names_not_in",
+    [
+        # the whole dataset is compared, not just the tags read when sorting
+        (
+            None,
+            [],
+            [
+                "Repetition&nbsp;Time",
+                "Referring&nbsp;Physician's&nbsp;Name",
+                "Patient's&nbsp;Name",
+            ],
+            [],
+        ),
+        (
+            "RepetitionTime\n0x00100010\n",
+            [
+                "--compare-one-inst",
+                "--ignore-private",
+                "--ignore-vr",
+                "UI",
+                "DT",
+                "--ignore-group",
+                "0x0010",
+                "--ignore-tag",
+                "Rows",
+                "SeriesNumber",
+            ],
+            ["Repetition&nbsp;Time"],
+            ["Referring&nbsp;Physician's&nbsp;Name", "Patient's&nbsp;Name"],
+        ),
+    ],
+    ids=["all_tags", "remove_tags"],
+)
+def test_dcmdiff_single_files(
+    tmp_path,
+    script_runner,
+    ref_ds_template,
+    ref_dcm_bytes,
+    tags,
+    extra_args,
+    names_in,
+    names_not_in,
+):
     fp_r = tmp_path / "ref.dcm"
-    ds_r = pydicom.dataset.Dataset()
-    ds_r.StudyDate = "20220101"
-    ds_r.PatientBirthDate = "19800101"
-    ds_r.PatientName = "SURNAME^Firstname"
-    ds_r.PatientID = "ABC12345678"
-    ds_r.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_r.SeriesDescription = "T1"
-    ds_r.RepetitionTime = 1000
-    ds_r.Modality = "MR"
-    ds_r.SeriesNumber = 10
-    ds_r.InstanceNumber = 1
-    ds_r.StudyInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SeriesInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_r.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_r.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_r.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_r.file_meta.ImplementationVersionName = "report"
-    ds_r.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_r.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_r.file_meta)
-    ds_r.save_as(fp_r, implicit_vr=False, little_endian=True, enforce_file_format=True)
+    r_uid = ref_ds_template.SOPInstanceUID
+    fp_r.write_bytes(ref_dcm_bytes)
 
     fp_t = tmp_path / "test.dcm"
-    ds_t = copy.deepcopy(ds_r)
+    ds_t = clone_ds(ref_ds_template)
     ds_t.RepetitionTime = 2000
     ds_t.save_as(fp_t, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     output_dir = tmp_path / "htmldiff"
 
-    result = script_runner.run(
-        [SCRIPT_NAME, str(fp_r), str(fp_t), "-o", str(output_dir)]
-    )
+    if tags is not None:
+        tags_fp = tmp_path / "tags.txt"
+        tags_fp.write_text(tags)
+
+        extra_args = ["-c", str(tags_fp)] + extra_args
+
+    # a single comparison is done without starting a pool of workers
+    with mock.patch.object(
+        dcmdiff.concurrent.futures.ProcessPoolExecutor, "map"
+    ) as mock_map:
+        result = script_runner.run(
+            [SCRIPT_NAME, str(fp_r), str(fp_t), "-o", str(output_dir)] + extra_args
+        )
+        mock_map.assert_not_called()
     assert result.success
     assert output_dir.is_dir()
 
@@ -922,48 +1520,43 @@ def test_dcmdiff_single_files(tmp_path, script_runner):
     fp_series_html = output_dir / "0010-MR-T1.html"
     assert fp_series_html.is_file()
 
-    fp_inst_html = output_dir / ("%s.html" % ds_r.SOPInstanceUID)
+    fp_inst_html = output_dir / (r_uid + ".html")
     assert fp_inst_html.is_file()
 
-    ref_study_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>DICOM Study</h1>\n",
-        "<p>Select a reference series to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">0010-MR-T1</a></li>\n' % str(fp_series_html),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
+    ref_study_contents = (
+        STUDY_HTML_HEAD
+        + '<li><a href="%s">0010-MR-T1</a></li>\n' % fp_series_html
+        + "</ol>\n"
+        + HTML_TAIL
+    )
 
-    ref_series_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>Reference series: 0010-MR-T1</h1>\n",
-        "<h1>Test series: 0010-MR-T1</h1>\n",
-        "<p>Select an instance to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">%s</a></li>\n' % (str(fp_inst_html), ds_r.SOPInstanceUID),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
+    ref_series_contents = (
+        HTML_HEAD
+        + "<h1>Reference series: 0010-MR-T1</h1>\n"
+        + "<h1>Test series: 0010-MR-T1</h1>\n"
+        + "<p>Select an instance to view differences:</p>\n"
+        + '<ol type= "1">\n'
+        + '<li><a href="%s">%s</a></li>\n' % (fp_inst_html, r_uid)
+        + "</ol>\n"
+        + HTML_TAIL
+    )
+
+    assert fp_study_html.read_text(encoding="utf-8") == ref_study_contents
 
-    with open(fp_study_html, "r") as f:
-        study_contents = f.readlines()
+    assert fp_series_html.read_text(encoding="utf-8") == ref_series_contents
 
-    assert study_contents == ref_study_contents
+    inst_contents = fp_inst_html.read_text(encoding="utf-8")
 
-    with open(fp_series_html, "r") as f:
-        series_contents = f.readlines()
+    for name in names_in:
+        assert name in inst_contents
 
-    assert series_contents == ref_series_contents
+    for name in names_not_in:
+        assert name not in inst_contents
 
 
-def test_dcmdiff_dirs_no_match_ser(tmp_path, script_runner):
+def test_dcmdiff_dirs_no_match_ser(
+    tmp_path, script_runner, ref_ds_template, ref_dcm_bytes
+):
     ref_dp = tmp_path / "ref"
     ref_dp.mkdir()
 
@@ -971,31 +1564,11 @@ def test_dcmdiff_dirs_no_match_ser(tmp_path, script_runner):
     test_dp.mkdir()
 
     fp_r = ref_dp / "ref.dcm"
-    ds_r = pydicom.dataset.Dataset()
-    ds_r.StudyDate = "20220101"
-    ds_r.PatientBirthDate = "19800101"
-    ds_r.PatientName = "SURNAME^Firstname"
-    ds_r.PatientID = "ABC12345678"
-    ds_r.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_r.SeriesDescription = "T1"
-    ds_r.Modality = "MR"
-    ds_r.SeriesNumber = 10
-    ds_r.InstanceNumber = 1
-    ds_r.StudyInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SeriesInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_r.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_r.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_r.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_r.file_meta.ImplementationVersionName = "report"
-    ds_r.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_r.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_r.file_meta)
-    ds_r.save_as(fp_r, implicit_vr=False, little_endian=True, enforce_file_format=True)
+    r_uid = ref_ds_template.SOPInstanceUID
+    fp_r.write_bytes(ref_dcm_bytes)
 
     fp_t_1 = test_dp / "test.dcm"
-    ds_t_1 = copy.deepcopy(ds_r)
+    ds_t_1 = clone_ds(ref_ds_template)
     ds_t_1.SeriesDescription = "BONE"
     ds_t_1.Modality = "CT"
     ds_t_1.SeriesNumber = 9
@@ -1022,44 +1595,93 @@ def test_dcmdiff_dirs_no_match_ser(tmp_path, script_runner):
     fp_series_html = output_dir / "0010-MR-T1.html"
     assert fp_series_html.is_file()
 
-    fp_inst_html = output_dir / ("%s.html" % ds_r.SOPInstanceUID)
+    fp_inst_html = output_dir / (r_uid + ".html")
     assert not fp_inst_html.is_file()
 
-    ref_study_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>DICOM Study</h1>\n",
-        "<p>Select a reference series to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">0010-MR-T1</a></li>\n' % str(fp_series_html),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
+    ref_study_contents = (
+        STUDY_HTML_HEAD
+        + '<li><a href="%s">0010-MR-T1</a></li>\n' % fp_series_html
+        + "</ol>\n"
+        + HTML_TAIL
+    )
 
-    ref_series_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>Reference series: 0010-MR-T1</h1>\n",
-        "<p>No series from test study selected for comparison</p>\n",
-        "</body>\n",
-        "</html>",
-    ]
+    ref_series_contents = (
+        HTML_HEAD
+        + "<h1>Reference series: 0010-MR-T1</h1>\n"
+        + "<p>No series from test study selected for comparison</p>\n"
+        + HTML_TAIL
+    )
 
-    with open(fp_study_html, "r") as f:
-        study_contents = f.readlines()
+    assert fp_study_html.read_text(encoding="utf-8") == ref_study_contents
 
-    assert study_contents == ref_study_contents
+    assert fp_series_html.read_text(encoding="utf-8") == ref_series_contents
 
-    with open(fp_series_html, "r") as f:
-        series_contents = f.readlines()
 
-    assert series_contents == ref_series_contents
+@pytest.mark.parametrize(
+    "extra_args", [[], ["--threads"]], ids=["processes", "threads"]
+)
+def test_dcmdiff_dirs_multi_inst(tmp_path, script_runner, ref_ds_template, extra_args):
+    ref_dp = tmp_path / "ref"
+    ref_dp.mkdir()
 
+    test_dp = tmp_path / "test"
+    test_dp.mkdir()
+
+    r_uids = []
+    for inst_num in [1, 2]:
+        ds_r = clone_ds(ref_ds_template)
+        ds_r.SOPInstanceUID = pydicom.uid.generate_uid()
+        ds_r.InstanceNumber = inst_num
+        ds_r.save_as(
+            ref_dp / ("ref_%d.dcm" % inst_num),
+            implicit_vr=False,
+            little_endian=True,
+            enforce_file_format=True,
+        )
+        r_uids.append(ds_r.SOPInstanceUID)
+
+        ds_t = clone_ds(ds_r)
+        ds_t.SOPInstanceUID = pydicom.uid.generate_uid()
+        ds_t.RepetitionTime = "2000"
+        ds_t.save_as(
+            test_dp / ("test_%d.dcm" % inst_num),
+            implicit_vr=False,
+            little_endian=True,
+            enforce_file_format=True,
+        )
+
+    output_dir = tmp_path / "htmldiff"
+
+    result = script_runner.run(
+        [SCRIPT_NAME, str(ref_dp), str(test_dp), "-o", str(output_dir)] + extra_args
+    )
+    assert result.success
+    assert "*** comparing 2 instances [100%]" in result.stdout
+
+    fp_series_html = output_dir / "0010-MR-T1.html"
+    fp_inst_html_list = [output_dir / (r_uid + ".html") for r_uid in r_uids]
+
+    ref_series_contents = (
+        HTML_HEAD
+        + "<h1>Reference series: 0010-MR-T1</h1>\n"
+        + "<h1>Test series: 0010-MR-T1</h1>\n"
+        + "<p>Select an instance to view differences:</p>\n"
+        + '<ol type= "1">\n'
+        + '<li><a href="%s">%s</a></li>\n' % (fp_inst_html_list[0], r_uids[0])
+        + '<li><a href="%s">%s</a></li>\n' % (fp_inst_html_list[1], r_uids[1])
+        + "</ol>\n"
+        + HTML_TAIL
+    )
+
+    assert fp_series_html.read_text(encoding="utf-8") == ref_series_contents
 
-def test_dcmdiff_dirs_no_match_inst(tmp_path, script_runner):
+    for fp_inst_html in fp_inst_html_list:
+        inst_contents = fp_inst_html.read_text(encoding="utf-8")
+        assert "Repetition&nbsp;Time" in inst_contents
+        assert 'class="diff_chg"' in inst_contents
+
+
+def test_dcmdiff_dirs_no_match_inst(tmp_path, script_runner, ref_ds_template):
     ref_dp = tmp_path / "ref"
     ref_dp.mkdir()
 
@@ -1067,31 +1689,14 @@ def test_dcmdiff_dirs_no_match_inst(tmp_path, script_runner):
     test_dp.mkdir()
 
     fp_r = ref_dp / "ref.dcm"
-    ds_r = pydicom.dataset.Dataset()
-    ds_r.StudyDate = "20220101"
-    ds_r.PatientBirthDate = "19800101"
-    ds_r.PatientName = "SURNAME^Firstname"
-    ds_r.PatientID = "ABC12345678"
-    ds_r.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_r.SeriesDescription = "T1"
-    ds_r.Modality = "MR"
-    ds_r.SeriesNumber = 10
+    ds_r = clone_ds(ref_ds_template)
+    r_uid = pydicom.uid.generate_uid()
+    ds_r.SOPInstanceUID = r_uid
     ds_r.InstanceNumber = 11
-    ds_r.StudyInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SeriesInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_r.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_r.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_r.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_r.file_meta.ImplementationVersionName = "report"
-    ds_r.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_r.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_r.file_meta)
     ds_r.save_as(fp_r, implicit_vr=False, little_endian=True, enforce_file_format=True)
 
     fp_t_1 = test_dp / "test.dcm"
-    ds_t_1 = copy.deepcopy(ds_r)
+    ds_t_1 = clone_ds(ds_r)
     ds_t_1.InstanceNumber = 1
     ds_t_1.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_t_1.save_as(
@@ -1099,7 +1704,7 @@ def test_dcmdiff_dirs_no_match_inst(tmp_path, script_runner):
     )
 
     fp_t_2 = test_dp / "test_2.dcm"
-    ds_t_2 = copy.deepcopy(ds_r)
+    ds_t_2 = clone_ds(ds_r)
     ds_t_2.InstanceNumber = 2
     ds_t_2.SOPInstanceUID = pydicom.uid.generate_uid()
     ds_t_2.save_as(
@@ -1123,167 +1728,36 @@ def test_dcmdiff_dirs_no_match_inst(tmp_path, script_runner):
     fp_series_html = output_dir / "0010-MR-T1.html"
     assert fp_series_html.is_file()
 
-    fp_inst_html = output_dir / ("%s.html" % ds_r.SOPInstanceUID)
+    fp_inst_html = output_dir / (r_uid + ".html")
     assert fp_inst_html.is_file()
 
-    ref_study_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>DICOM Study</h1>\n",
-        "<p>Select a reference series to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">0010-MR-T1</a></li>\n' % str(fp_series_html),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
-
-    ref_series_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>Reference series: 0010-MR-T1</h1>\n",
-        "<h1>Test series: 0010-MR-T1</h1>\n",
-        "<p>Select an instance to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">%s</a></li>\n' % (str(fp_inst_html), ds_r.SOPInstanceUID),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
-
-    ref_inst_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>Instance %s</h1>\n" % ds_r.SOPInstanceUID,
-        "<p>No instance from test series found or selected for comparison</p>\n",
-        "</body>\n",
-        "</html>",
-    ]
-
-    with open(fp_study_html, "r") as f:
-        study_contents = f.readlines()
-
-    assert study_contents == ref_study_contents
-
-    with open(fp_series_html, "r") as f:
-        series_contents = f.readlines()
-
-    assert series_contents == ref_series_contents
-
-    with open(fp_inst_html, "r") as f:
-        inst_contents = f.readlines()
-
-    assert inst_contents == ref_inst_contents
-
-
-def test_dcmdiff_single_remove_tags(tmp_path, script_runner):
-    fp_r = tmp_path / "ref.dcm"
-    ds_r = pydicom.dataset.Dataset()
-    ds_r.StudyDate = "20220101"
-    ds_r.PatientBirthDate = "19800101"
-    ds_r.PatientName = "SURNAME^Firstname"
-    ds_r.PatientID = "ABC12345678"
-    ds_r.ReferringPhysicianName = "DrSURNAME^DrFirstname"
-    ds_r.SeriesDescription = "T1"
-    ds_r.RepetitionTime = 1000
-    ds_r.Modality = "MR"
-    ds_r.SeriesNumber = 10
-    ds_r.InstanceNumber = 1
-    ds_r.StudyInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SeriesInstanceUID = pydicom.uid.generate_uid()
-    ds_r.SOPInstanceUID = pydicom.uid.generate_uid()
-    ds_r.file_meta = pydicom.dataset.FileMetaDataset()
-    ds_r.file_meta.TransferSyntaxUID = "1.2.840.10008.1.2.1"
-    ds_r.file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
-    ds_r.file_meta.ImplementationVersionName = "report"
-    ds_r.file_meta.ImplementationClassUID = "1.2.3.4"
-    ds_r.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
-
-    pydicom.dataset.validate_file_meta(ds_r.file_meta)
-    ds_r.save_as(fp_r, implicit_vr=False, little_endian=True, enforce_file_format=True)
-
-    fp_t = tmp_path / "test.dcm"
-    ds_t = copy.deepcopy(ds_r)
-    ds_t.RepetitionTime = 2000
-    ds_t.save_as(fp_t, implicit_vr=False, little_endian=True, enforce_file_format=True)
-
-    output_dir = tmp_path / "htmldiff"
-
-    tags_fp = tmp_path / "tags.txt"
-    tags_fp.touch()
-
-    with open(tags_fp, "w") as f:
-        f.writelines(["RepetitionTime\n", "0x00100010\n"])
-
-    result = script_runner.run(
-        [
-            SCRIPT_NAME,
-            str(fp_r),
-            str(fp_t),
-            "-o",
-            str(output_dir),
-            "-c",
-            str(tags_fp),
-            "--compare-one-inst",
-            "--ignore-private",
-            "--ignore-vr",
-            "UI",
-            "DT",
-            "--ignore-group",
-            "0x0010",
-            "--ignore-tag",
-            "Rows",
-            "SeriesNumber",
-        ]
+    ref_study_contents = (
+        STUDY_HTML_HEAD
+        + '<li><a href="%s">0010-MR-T1</a></li>\n' % fp_series_html
+        + "</ol>\n"
+        + HTML_TAIL
     )
-    assert result.success
-    assert output_dir.is_dir()
-
-    fp_study_html = output_dir / "study_index.html"
-    assert fp_study_html.is_file()
-
-    fp_series_html = output_dir / "0010-MR-T1.html"
-    assert fp_series_html.is_file()
-
-    fp_inst_html = output_dir / ("%s.html" % ds_r.SOPInstanceUID)
-    assert fp_inst_html.is_file()
 
-    ref_study_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>DICOM Study</h1>\n",
-        "<p>Select a reference series to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">0010-MR-T1</a></li>\n' % str(fp_series_html),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
-
-    ref_series_contents = [
-        "<!DOCTYPE html>\n",
-        "<html>\n",
-        "<body>\n",
-        "<h1>Reference series: 0010-MR-T1</h1>\n",
-        "<h1>Test series: 0010-MR-T1</h1>\n",
-        "<p>Select an instance to view differences:</p>\n",
-        '<ol type= "1">\n',
-        '<li><a href="%s">%s</a></li>\n' % (str(fp_inst_html), ds_r.SOPInstanceUID),
-        "</ol>\n",
-        "</body>\n",
-        "</html>",
-    ]
+    ref_series_contents = (
+        HTML_HEAD
+        + "<h1>Reference series: 0010-MR-T1</h1>\n"
+        + "<h1>Test series: 0010-MR-T1</h1>\n"
+        + "<p>Select an instance to view differences:</p>\n"
+        + '<ol type= "1">\n'
+        + '<li><a href="%s">%s</a></li>\n' % (fp_inst_html, r_uid)
+        + "</ol>\n"
+        + HTML_TAIL
+    )
 
-    with open(fp_study_html, "r") as f:
-        study_contents = f.readlines()
+    ref_inst_contents = (
+        HTML_HEAD
+        + "<h1>Instance %s</h1>\n" % r_uid
+        + "<p>No instance from test series found or selected for comparison</p>\n"
+        + HTML_TAIL
+    )
 
-    assert study_contents == ref_study_contents
+    assert fp_study_html.read_text(encoding="utf-8") == ref_study_contents
 
-    with open(fp_series_html, "r") as f:
-        series_contents = f.readlines()
+    assert fp_series_html.read_text(encoding="utf-8") == ref_series_contents
 
-    assert series_contents == ref_series_contents
+    assert fp_inst_html.read_text(encoding="utf-8") == ref_inst_contents